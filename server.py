@@ -77,7 +77,7 @@ def hello():
 def set_pause():
     global paused
     paused = True
-    a_star.motors(0, 0)  # 立即停止电机
+    robot_control.stop_movement()  # 立即停止电机
     a_star.servo_disable()  # 禁用伺服器
     return ""
 
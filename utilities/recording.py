@@ -2,6 +2,11 @@
 
 import subprocess
 import os
+import atexit
+import logging
+import logging.handlers
+import multiprocessing
+import queue
 import signal
 import time
 from datetime import datetime
@@ -10,10 +15,29 @@ import pyaudio
 import numpy as np
 import struct
 import socket
+import selectors
 import json
-import wave
+import re
+import shutil
+from base64 import b85encode
+from binascii import b2a_base64
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 import sys
+import tempfile
+
+# Control-path log messages go through a queue and are written to stdout by a
+# listener thread, so a slow terminal/SSH pipe never blocks the Flask handlers
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_queue = queue.Queue(-1)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(logging.Formatter('%(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
 # Add ReSpeaker module path
 respeaker_path = "/home/robff/robff/usb_4_mic_array"
@@ -41,7 +65,6 @@ except ImportError as e:
     RESPEAKER_AVAILABLE = False
 
 
-import wave
 import threading
 import time
 import os
@@ -52,6 +75,242 @@ import usb.core
 import usb.util
 from tuning import Tuning
 
+# Optional JIT for the per-chunk audio level (falls back to numpy)
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Optional faster JSON encoder for the SSH packets (falls back to json)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Optional in-process camera capture (VideoStreamer backend='pyav')
+try:
+    import av
+    AV_AVAILABLE = True
+except ImportError:
+    AV_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _mean_abs_i16(samples, scratch):
+        """Mean absolute amplitude of a 1-D int16 buffer in a single pass (scratch unused)"""
+        total = 0
+        for i in range(samples.size):
+            value = np.int64(samples[i])
+            total += value if value >= 0 else -value
+        return total / samples.size
+else:
+    def _mean_abs_i16(samples, scratch):
+        """Mean absolute amplitude of a 1-D int16 buffer, using scratch (int16, >= samples.size) for |x|
+        
+        abs(-32768) wraps to -32768 in int16, which reads back as 32768
+        through a uint16 view, so no widened temporary is needed.
+        """
+        out = scratch[:samples.size]
+        np.abs(samples, out=out)
+        return out.view(np.uint16).mean()
+
+
+# Binary SSH stream framing: header followed by the raw int16 PCM chunk
+#   timestamp (f64), channels (u16), doa (u16, 0xFFFF = unknown),
+#   audio_level (f32), frame (u32), payload bytes (u32)
+_SSH_HEADER = struct.Struct('<dHHfII')
+_SSH_DOA_UNKNOWN = 0xFFFF
+
+# DOAANGLE read request as Tuning.read('DOAANGLE') builds it
+# (parameter id 21, offset 0, int type -> cmd 0x80 | 0x40 | 0)
+_DOA_PARAM_ID = 21
+_DOA_READ_CMD = 0xC0
+_DOA_RESPONSE = struct.Struct('ii')
+
+# Binary DOA log record (doa_log_format='binary'):
+#   timestamp (f64), frame (u32), doa_angle (i16, -1 = none), audio_level (f32)
+_DOA_REC = struct.Struct('<dIhf')
+
+
+def read_doa_bin(path):
+    """Yield the entries of a binary DOA log as the same dicts the JSONL log holds"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    usable = len(data) - len(data) % _DOA_REC.size  # ignore a torn last record
+    for ts, frame, doa, level in _DOA_REC.iter_unpack(data[:usable]):
+        yield {
+            'timestamp': ts,
+            'frame': frame,
+            'doa_angle': None if doa < 0 else doa,
+            'audio_level': level
+        }
+
+# CPU split on the 4-core Pi: the audio drain thread gets core 3 with
+# SCHED_FIFO, camera recorders stay on cores 0-1. Needs CAP_SYS_NICE for the
+# priority (setcap cap_sys_nice+ep on the python binary); without it only the
+# affinity is applied.
+AUDIO_CPUS = {3}
+AUDIO_FIFO_PRIORITY = 20
+RECORDER_CPUS = {0, 1}
+# Recorders also get a raised nice value and the highest best-effort I/O
+# priority, ahead of the Flask workers on the same cores (nice also needs
+# CAP_SYS_NICE)
+RECORDER_NICE = -5
+
+
+# Without CAP_SYS_NICE every spawn would fail the same way; say so once
+_priority_warned = False
+
+
+def _warn_priority(message, error):
+    global _priority_warned
+    if not _priority_warned:
+        _priority_warned = True
+        logger.warning("%s: %s (not repeated)", message, error)
+
+
+def _pin_to_cpus(pid, cpus, fifo_priority=None):
+    """Best-effort CPU affinity (and SCHED_FIFO) for a process or, with pid 0, the calling thread"""
+    if (os.cpu_count() or 1) <= max(cpus):
+        return
+    try:
+        os.sched_setaffinity(pid, cpus)
+        if fifo_priority is not None:
+            os.sched_setscheduler(pid, os.SCHED_FIFO, os.sched_param(fifo_priority))
+    except (OSError, AttributeError) as e:
+        _warn_priority("Could not set CPU affinity/priority", e)
+
+
+# ionice runs as a prefix of the recorder command rather than as a separate
+# process waited on from the start path; -t keeps the recorder running if the
+# I/O class can't be set
+_IONICE = shutil.which('ionice')
+
+
+def _ionice_cmd(cmd):
+    """cmd prefixed to run at I/O priority best-effort 0, when ionice is available"""
+    if not _IONICE:
+        return cmd
+    return [_IONICE, '-c', '2', '-n', '0', '-t'] + cmd
+
+
+def _prioritize_recorder(pid):
+    """Best-effort CPU (nice) priority for a recorder process"""
+    try:
+        os.setpriority(os.PRIO_PROCESS, pid, RECORDER_NICE)
+    except OSError as e:
+        _warn_priority("Could not raise recorder priority", e)
+
+
+# Enhanced detection patterns for the ReSpeaker audio device name
+_RESPEAKER_NAME_RE = re.compile(r'respeaker|arrayuac10|2886:0018|seeed|mic array|uac1\.0', re.IGNORECASE)
+
+def _encode_ssh_packet(stream_format, channels, timestamp, frame, doa_angle, audio_level, pcm):
+    """Build one SSH stream packet for a chunk of int16 PCM bytes"""
+    if stream_format == 'binary':
+        return _SSH_HEADER.pack(
+            timestamp, channels,
+            _SSH_DOA_UNKNOWN if doa_angle is None else doa_angle,
+            audio_level, frame, len(pcm)
+        ) + pcm
+    
+    packet = {
+        'type': 'respeaker_data',
+        'timestamp': timestamp,
+        'doa_angle': doa_angle,
+        'audio_level': audio_level,
+        'audio_shape': (len(pcm) // (2 * channels), channels)
+    }
+    if stream_format == 'json_b64':
+        # 4/3 expansion instead of 2x
+        packet['audio_data'] = b2a_base64(pcm, newline=False).decode('ascii')
+        packet['audio_encoding'] = 'base64'
+    elif stream_format == 'json_b85':
+        # 5/4 expansion; b85encode is slower but runs in the worker process
+        packet['audio_data'] = b85encode(pcm).decode('ascii')
+        packet['audio_encoding'] = 'base85'
+    else:
+        packet['audio_data'] = pcm.hex()
+    
+    # Send as JSON (orjson already returns bytes)
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(packet) + b'\n'
+    return (json.dumps(packet) + '\n').encode('utf-8')
+
+
+def _ssh_worker(ssh_socket, stream_format, channels, chunks, alive):
+    """SSH streaming process: encode queued chunks and send them until a None sentinel
+    
+    Clears alive and exits when the laptop connection fails.
+    """
+    # Shutdown is driven by the parent's sentinel, not by Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    try:
+        while True:
+            chunk = chunks.recv()
+            if chunk is None:
+                break
+            ssh_socket.sendall(_encode_ssh_packet(stream_format, channels, *chunk))
+    except EOFError:
+        # Parent closed the pipe without a sentinel
+        pass
+    except OSError as e:
+        print(f"SSH streaming error: {e}")
+    finally:
+        alive.clear()
+        ssh_socket.close()
+
+
+class _WavWriter:
+    """Append-only PCM WAV file: chunks go straight to the file, sizes are patched on close"""
+    
+    # RIFF header + 16-byte PCM fmt chunk + data chunk header (44 bytes)
+    HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+    
+    def __init__(self, path, channels, sampwidth, rate):
+        self.channels = channels
+        self.sampwidth = sampwidth
+        self.rate = rate
+        self.nbytes = 0
+        self._file = open(path, 'wb', buffering=1 << 20)  # coalesce ~5 s of 6ch PCM per write()
+        self._write_header()
+    
+    def _write_header(self):
+        data_size = min(self.nbytes, 0xFFFFFFFF - 36)  # RIFF sizes are 32-bit
+        block_align = self.channels * self.sampwidth
+        self._file.write(self.HEADER.pack(
+            b'RIFF', 36 + data_size, b'WAVE',
+            b'fmt ', 16, 1, self.channels, self.rate, self.rate * block_align, block_align, self.sampwidth * 8,
+            b'data', data_size
+        ))
+    
+    @property
+    def size(self):
+        """File size in bytes, including data still in the write buffer"""
+        return self.HEADER.size + self.nbytes
+    
+    def write(self, data):
+        """Append raw PCM from any buffer (bytes, memoryview, contiguous ndarray)"""
+        self.nbytes += self._file.write(data)
+    
+    def flush(self):
+        self._file.flush()
+    
+    def fileno(self):
+        return self._file.fileno()
+    
+    def close(self):
+        try:
+            self._file.seek(0)
+            self._write_header()
+        finally:
+            self._file.close()
+
+
 class ReSpeakerController:
     """Handles ReSpeaker microphone array DOA and raw audio capture with real-time file writing"""
     
@@ -70,26 +329,85 @@ class ReSpeakerController:
         # Real-time file writing components
         self.wav_file = None
         self.wav_file_lock = threading.Lock()
+        self._wav_size = 0  # final WAV size once the file is closed
+        
+        # Optional compressed copy: the drain thread also hands the PCM to an
+        # ffmpeg AAC encoder (the raw WAV is still written for the 6ch analysis).
+        # Like the SSH path, chunks go through a bounded queue to a normal
+        # priority feeder thread and are dropped when it is full, so a stalled
+        # encoder can't block the drain.
+        self.encode_aac = False
+        self.aac_file = None
+        self.aac_queue_size = 64
+        self._aac_process = None
+        self._aac_queue = None
+        self._aac_feeder = None
+        self._aac_dropped = 0
         self.doa_file = None
         self.doa_file_lock = threading.Lock()
         
-        # Data storage (keep minimal for backup)
-        self.raw_audio_data = []
-        self.doa_data = []
+        # Capture ring: the PortAudio callback copies each chunk into a
+        # preallocated (slots, chunk_size, channels) int16 array and the drain
+        # thread consumes it. Slot count must be a power of two (~4s at 64 slots).
+        self.ring_slots = 64
+        self._ring_mask = self.ring_slots - 1
+        self._ring = None
+        self._ring_frames = None
+        self._ring_time = None
+        self._ring_write = 0
+        self._ring_read = 0
+        self._ring_dropped = 0
+        self._ring_ready = threading.Event()
+        
+        # DOA log entries are staged in preallocated arrays and written out
+        # once per batch (doa_angle -1 means no reading). doa_log_format is
+        # 'jsonl' or 'binary' (fixed _DOA_REC records, see read_doa_bin)
+        self.doa_log_format = 'jsonl'
+        self.doa_batch_size = 10
+        self._doa_ts = None
+        self._doa_frame = None
+        self._doa_angle = None
+        self._doa_level = None
+        self._doa_batch_len = 0
+        
+        self.doa_entry_count = 0
         self.is_capturing = False
         
         # SSH streaming
         self.ssh_socket = None
         self.ssh_connected = False
-        
-        # DOA tracking
-        self.doa_thread = None
+        self.on_ssh_state_change = None  # called with the new ssh_connected value
+        self.ssh_stream_format = 'json'
+        # Chunks are handed to the _ssh_worker process, which does the packet
+        # encoding and socket writes outside this process's GIL. The capture
+        # loop only queues them in-process (a chunk is dropped when the queue
+        # is full); _ssh_feeder, started from the unpinned control thread,
+        # pickles them into the pipe so that work never runs on the audio
+        # core at SCHED_FIFO.
+        self.ssh_queue_size = 32
+        self._ssh_queue = None
+        self._ssh_conn = None
+        self._ssh_feeder = None
+        self._ssh_alive = None
+        self._ssh_process = None
+        self._ssh_dropped = 0
+        
+        # DOA tracking (polled from the capture loop, ~5Hz so the control
+        # transfers leave room for the isochronous audio on the same bus).
+        # current_doa has a single writer (the drain thread); attribute stores
+        # are atomic, so readers on other threads use it without a lock.
+        # current_doa_sample is (angle, time.monotonic()) of the last good read.
         self.current_doa = None
-        self.doa_lock = threading.Lock()
+        self.current_doa_sample = (None, 0.0)
+        self.doa_poll_frames = max(1, round(0.2 * rate / chunk_size))
+        self.doa_timeout_ms = max(1, int(1000 * chunk_size / rate))
+        self._doa_read_count = 0
+        self._doa_error_count = 0
         
-        # Checkpoint saving
+        # Checkpoint saving (also the only point the files are fsynced)
         self.checkpoint_counter = 0
         self.checkpoint_interval = 1000
+        self.flush_interval = 2.0  # seconds between WAV buffer flushes
         
     def initialize(self):
         """Initialize ReSpeaker hardware and audio interface"""
@@ -123,59 +441,44 @@ class ReSpeakerController:
                 
             print(f"ReSpeaker audio device found at index: {self.device_index}")
             
-            # Start DOA reading thread if USB device is available
-            if self.Mic_tuning:
-                self._start_doa_thread()
-            
             return True
             
         except Exception as e:
             print(f"Error initializing ReSpeaker: {e}")
             return False
     
-    def _start_doa_thread(self):
-        """Start separate thread for DOA readings"""
-        if not self.Mic_tuning:
-            return
-            
-        self.doa_thread = threading.Thread(target=self._doa_reading_loop)
-        self.doa_thread.daemon = True
-        self.doa_thread.start()
-        print("DOA reading thread started")
+    def _read_doa_angle(self):
+        """Read DOAANGLE with a control transfer bounded by one chunk period
+        
+        Tuning.direction waits up to Tuning.TIMEOUT (100s) on a stalled device,
+        which would stall the drain thread; here a slow read just fails fast.
+        """
+        response = self.usb_device.ctrl_transfer(
+            usb.util.CTRL_IN | usb.util.CTRL_TYPE_VENDOR | usb.util.CTRL_RECIPIENT_DEVICE,
+            0, _DOA_READ_CMD, _DOA_PARAM_ID, _DOA_RESPONSE.size, self.doa_timeout_ms)
+        return _DOA_RESPONSE.unpack_from(response)[0]
     
-    def _doa_reading_loop(self):
-        """Separate thread for reading DOA values"""
-        doa_log_counter = 0
-        
-        while self.Mic_tuning:
-            try:
-                # Read DOA value
-                doa_value = self.Mic_tuning.direction
-                
-                # Update current DOA with thread lock
-                with self.doa_lock:
-                    self.current_doa = doa_value
-                
-                # 每30次读取打印一次日志 (30 * 0.1s = 3秒)
-                doa_log_counter += 1
-                if doa_log_counter % 30 == 1:
-                    print(f"DOA: {doa_value}°")
-                
-                # Small delay to prevent overwhelming the USB device
-                time.sleep(0.1)  # 10Hz update rate
-                
-            except Exception as e:
-                # 减少错误日志频率
-                if hasattr(self, '_doa_error_count'):
-                    self._doa_error_count += 1
-                else:
-                    self._doa_error_count = 1
-                    
-                # 每300次错误打印一次 (约30秒)
-                if self._doa_error_count % 300 == 1:
-                    print(f"DOA error (#{self._doa_error_count}): {e}")
-                
-                time.sleep(0.1)
+    def _poll_doa(self):
+        """Read the DOA angle from the USB device (called from the capture loop)"""
+        try:
+            doa_value = self._read_doa_angle()
+        except Exception as e:
+            # 每150次错误打印一次 (约30秒)
+            self._doa_error_count += 1
+            if self._doa_error_count % 150 == 1:
+                print(f"DOA error (#{self._doa_error_count}): {e}")
+            return self.current_doa
+        
+        # Publish for get_current_doa() callers on other threads
+        self.current_doa = doa_value
+        self.current_doa_sample = (doa_value, time.monotonic())
+        
+        # 每15次读取打印一次日志 (约3秒)
+        self._doa_read_count += 1
+        if self._doa_read_count % 15 == 1:
+            print(f"DOA: {doa_value}°")
+        
+        return doa_value
     
     def _find_respeaker_audio_device(self):
         """Find ReSpeaker audio device index"""
@@ -185,20 +488,9 @@ class ReSpeakerController:
         print("Scanning for ReSpeaker audio devices...")
         for i in range(self.audio.get_device_count()):
             info = self.audio.get_device_info_by_index(i)
-            device_name = info['name'].lower()
             print(f"  Device {i}: {info['name']} (channels: {info['maxInputChannels']})")
             
-            # Enhanced detection patterns for ReSpeaker
-            respeaker_keywords = [
-                'respeaker', 
-                'arrayuac10', 
-                '2886:0018',
-                'seeed',
-                'mic array',
-                'uac1.0'
-            ]
-            
-            if any(keyword in device_name for keyword in respeaker_keywords):
+            if _RESPEAKER_NAME_RE.search(info['name']):
                 # Additional validation: check if it has enough input channels
                 if info['maxInputChannels'] >= self.channels:
                     print(f"Found ReSpeaker audio device: {info['name']}")
@@ -209,20 +501,61 @@ class ReSpeakerController:
         print("No suitable ReSpeaker audio device found")
         return None
     
-    def setup_ssh_streaming(self, ssh_host, ssh_port=9999):
-        """Setup SSH socket for streaming data to laptop"""
+    def setup_ssh_streaming(self, ssh_host, ssh_port=9999, stream_format='json'):
+        """Setup SSH socket for streaming data to laptop
+        
+        stream_format is 'json' (one JSON line per chunk, hex audio), 'json_b64' /
+        'json_b85' (same, base64/base85 audio with audio_encoding set) or 'binary'
+        (_SSH_HEADER followed by the raw PCM).
+        """
+        self.ssh_stream_format = stream_format
+        
         try:
-            import socket
             self.ssh_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Large send buffer so sendall() rarely blocks the capture loop,
+            # and no Nagle delay since every packet is one complete write
+            self.ssh_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+            self.ssh_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             self.ssh_socket.connect((ssh_host, ssh_port))
-            self.ssh_connected = True
+            
+            # The worker gets its own copy of the connected socket. Fork
+            # explicitly: under spawn/forkserver (the Linux default from
+            # Python 3.14) the child re-imports __main__, and server.py builds
+            # the recorder and the A-Star connection at import time.
+            context = multiprocessing.get_context('fork')
+            reader, self._ssh_conn = context.Pipe(duplex=False)
+            self._ssh_alive = context.Event()
+            self._ssh_alive.set()
+            self._ssh_process = context.Process(
+                target=_ssh_worker,
+                args=(self.ssh_socket, stream_format, self.channels, reader, self._ssh_alive),
+                daemon=True
+            )
+            self._ssh_process.start()
+            reader.close()
+            
+            # Created here rather than lazily from the capture loop, so the
+            # feeder inherits this thread's affinity and scheduling policy
+            self._ssh_queue = queue.Queue(maxsize=self.ssh_queue_size)
+            self._ssh_feeder = threading.Thread(target=self._feed_ssh_worker, daemon=True)
+            self._ssh_feeder.start()
+            
+            self._set_ssh_connected(True)
             print(f"Connected to SSH laptop at {ssh_host}:{ssh_port}")
             return True
         except Exception as e:
             print(f"Failed to connect to SSH laptop: {e}")
-            self.ssh_connected = False
+            self._set_ssh_connected(False)
             return False
     
+    def _set_ssh_connected(self, connected):
+        """Update ssh_connected and notify on_ssh_state_change when it flips"""
+        if connected == self.ssh_connected:
+            return
+        self.ssh_connected = connected
+        if self.on_ssh_state_change:
+            self.on_ssh_state_change(connected)
+    
     def start_capture(self, output_dir, filename_prefix):
         """Start capturing raw audio and DOA data with real-time file writing"""
         if not self.device_index:
@@ -230,19 +563,10 @@ class ReSpeakerController:
             return False
             
         try:
-            # Setup audio stream
-            self.stream = self.audio.open(
-                format=self.format,
-                channels=self.channels,
-                rate=self.rate,
-                input=True,
-                input_device_index=self.device_index,
-                frames_per_buffer=self.chunk_size
-            )
-            
             # Setup output files
             self.raw_audio_file = os.path.join(output_dir, f"{filename_prefix}_respeaker_raw.wav")
-            self.doa_log_file = os.path.join(output_dir, f"{filename_prefix}_doa_log.jsonl")
+            doa_ext = 'doa.bin' if self.doa_log_format == 'binary' else 'doa_log.jsonl'
+            self.doa_log_file = os.path.join(output_dir, f"{filename_prefix}_{doa_ext}")
             
             # Initialize real-time WAV file writing
             self._initialize_wav_file()
@@ -250,13 +574,40 @@ class ReSpeakerController:
             # Initialize real-time DOA log file
             self._initialize_doa_file()
             
+            if self.encode_aac:
+                self.aac_file = os.path.join(output_dir, f"{filename_prefix}_respeaker.m4a")
+                self._start_aac_encoder()
+            
             # Initialize data storage
-            self.raw_audio_data = []
-            self.doa_data = []
+            self._ring = np.empty((self.ring_slots, self.chunk_size, self.channels), dtype=np.int16)
+            self._ring_frames = np.zeros(self.ring_slots, dtype=np.int32)
+            self._ring_time = np.zeros(self.ring_slots, dtype=np.float64)
+            self._ring_write = 0
+            self._ring_read = 0
+            self._ring_dropped = 0
+            self._doa_ts = np.empty(self.doa_batch_size, dtype=np.float64)
+            self._doa_frame = np.empty(self.doa_batch_size, dtype=np.int64)
+            self._doa_angle = np.empty(self.doa_batch_size, dtype=np.int16)
+            self._doa_level = np.empty(self.doa_batch_size, dtype=np.float64)
+            self._doa_batch_len = 0
+            self.doa_entry_count = 0
+            self.current_doa = None
+            self.current_doa_sample = (None, 0.0)
             self.is_capturing = True
             self.checkpoint_counter = 0
             
-            # Start capture thread
+            # Setup audio stream in callback mode (starts delivering immediately)
+            self.stream = self.audio.open(
+                format=self.format,
+                channels=self.channels,
+                rate=self.rate,
+                input=True,
+                input_device_index=self.device_index,
+                frames_per_buffer=self.chunk_size,
+                stream_callback=self._pa_callback
+            )
+            
+            # Start drain thread
             self.capture_thread = threading.Thread(target=self._capture_loop_realtime)
             self.capture_thread.daemon = True
             self.capture_thread.start()
@@ -268,145 +619,321 @@ class ReSpeakerController:
             
         except Exception as e:
             print(f"Error starting ReSpeaker capture: {e}")
+            self.is_capturing = False
             return False
     
     def _initialize_wav_file(self):
         """Initialize WAV file for real-time writing"""
         try:
             with self.wav_file_lock:
-                self.wav_file = wave.open(self.raw_audio_file, 'wb')
-                self.wav_file.setnchannels(self.channels)
-                self.wav_file.setsampwidth(self.audio.get_sample_size(self.format))
-                self.wav_file.setframerate(self.rate)
+                self.wav_file = _WavWriter(
+                    self.raw_audio_file, self.channels,
+                    self.audio.get_sample_size(self.format), self.rate
+                )
             print(f"WAV file initialized: {self.raw_audio_file}")
         except Exception as e:
             print(f"Error initializing WAV file: {e}")
             raise
     
+    def _start_aac_encoder(self):
+        """Start ffmpeg reading s16le PCM on stdin and writing self.aac_file"""
+        ffmpeg_cmd = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 's16le', '-ar', str(self.rate), '-ac', str(self.channels),
+            '-i', '-',
+            '-c:a', 'aac', '-b:a', '192k',
+            self.aac_file
+        ]
+        try:
+            self._aac_process = subprocess.Popen(
+                ffmpeg_cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+            _pin_to_cpus(self._aac_process.pid, RECORDER_CPUS)
+            print(f"AAC encoder started: {self.aac_file}")
+        except OSError as e:
+            print(f"Error starting AAC encoder: {e}")
+            self._aac_process = None
+            return
+        
+        # Started from the control thread, before the drain thread pins itself
+        self._aac_dropped = 0
+        self._aac_queue = queue.Queue(maxsize=self.aac_queue_size)
+        self._aac_feeder = threading.Thread(
+            target=self._feed_aac_encoder, args=(self._aac_process, self._aac_queue), daemon=True)
+        self._aac_feeder.start()
+    
+    def _feed_aac_encoder(self, process, chunks):
+        """Write queued PCM chunks to the encoder's stdin until a None sentinel"""
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                process.stdin.write(chunk)
+        except OSError as e:
+            print(f"AAC encoder stopped: {e}")
+            # The drain thread stops queueing
+            self._aac_queue = None
+    
+    def _stop_aac_encoder(self):
+        """Let the feeder finish, close the encoder's stdin so it finalizes the file, then wait for it"""
+        process = self._aac_process
+        if not process:
+            return
+        self._aac_process = None
+        chunks, self._aac_queue = self._aac_queue, None
+        if chunks is not None:
+            try:
+                chunks.put(None, timeout=1)
+            except queue.Full:
+                pass
+        if self._aac_feeder:
+            self._aac_feeder.join(timeout=2)
+            if self._aac_feeder.is_alive():
+                # Stuck writing to a stalled encoder; closing stdin would block too
+                print("AAC encoder not reading, killing it")
+                process.kill()
+                self._aac_feeder.join(timeout=2)
+            self._aac_feeder = None
+        if self._aac_dropped:
+            print(f"AAC encoder fell behind, {self._aac_dropped} chunks dropped")
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    
     def _initialize_doa_file(self):
-        """Initialize DOA log file for real-time writing (JSONL format)"""
+        """Initialize DOA log file for real-time writing (JSONL or binary format)"""
         try:
+            mode = 'ab' if self.doa_log_format == 'binary' else 'w'
             with self.doa_file_lock:
-                self.doa_file = open(self.doa_log_file, 'w')
+                self.doa_file = open(self.doa_log_file, mode, buffering=1 << 16)
             print(f"DOA log file initialized: {self.doa_log_file}")
         except Exception as e:
             print(f"Error initializing DOA file: {e}")
             raise
     
+    def _pa_callback(self, in_data, frame_count, time_info, status):
+        """PortAudio callback: copy the chunk into the ring and return immediately"""
+        write_idx = self._ring_write
+        if write_idx - self._ring_read >= self.ring_slots:
+            # Drain thread is a whole ring behind; drop this chunk
+            self._ring_dropped += 1
+            return (None, pyaudio.paContinue)
+        
+        slot = write_idx & self._ring_mask
+        self._ring[slot, :frame_count] = np.frombuffer(in_data, dtype=np.int16).reshape(frame_count, self.channels)
+        self._ring_frames[slot] = frame_count
+        self._ring_time[slot] = time.time()
+        self._ring_write = write_idx + 1
+        self._ring_ready.set()
+        return (None, pyaudio.paContinue)
+    
     def _capture_loop_realtime(self):
-        """Main capture loop with real-time file writing"""
+        """Drain captured chunks from the ring with real-time file writing"""
         frame_count = 0
         log_interval = 150
         doa_log_counter = 0
         doa_record_interval = int(1.0 / (self.chunk_size / self.rate))
+        doa_poll_frames = self.doa_poll_frames
+        doa_angle = None
+        ring = self._ring
+        ring_frames = self._ring_frames
+        ring_time = self._ring_time
+        ring_mask = self._ring_mask
+        ring_ready = self._ring_ready
+        
+        # Keep ffmpeg and kernel threads from delaying the drain
+        _pin_to_cpus(0, AUDIO_CPUS, AUDIO_FIFO_PRIORITY)
+        
+        # Bind everything the loop touches per chunk as locals
+        mean_abs = _mean_abs_i16
+        level_scratch = np.empty(self.chunk_size * self.channels, dtype=np.int16)
+        monotonic = time.monotonic
+        flush_interval = self.flush_interval
+        last_flush = monotonic()
+        wav_lock = self.wav_file_lock
+        poll_doa = self._poll_doa
+        # Mic_tuning is only released in cleanup(), after capture has stopped
+        has_doa = self.Mic_tuning is not None
+        stream_to_ssh = self._stream_to_ssh
+        doa_ts = self._doa_ts
+        doa_frame = self._doa_frame
+        doa_angles = self._doa_angle
+        doa_level = self._doa_level
+        doa_batch_size = self.doa_batch_size
+        checkpoint_interval = self.checkpoint_interval
         
         print("Starting real-time capture loop...")
         
-        while self.is_capturing:
+        # Keep draining after the stream stops until the ring is empty
+        while self.is_capturing or self._ring_read != self._ring_write:
+            if self._ring_read == self._ring_write:
+                ring_ready.clear()
+                if self._ring_read == self._ring_write:
+                    ring_ready.wait(0.1)
+                continue
+            
+            slot = self._ring_read & ring_mask
             try:
-                # Read audio data
-                audio_data = self.stream.read(self.chunk_size, exception_on_overflow=False)
-                timestamp = time.time()
+                # View into the ring slot, no copies; the level is only
+                # computed for chunks that are logged or streamed
+                audio_array = ring[slot, :ring_frames[slot]]
+                timestamp = float(ring_time[slot])
+                audio_level = None
                 
                 # **REAL-TIME AUDIO WRITING**
-                with self.wav_file_lock:
-                    if self.wav_file:
-                        self.wav_file.writeframes(audio_data)
-                        # Force flush to disk every 10 frames for safety
-                        if frame_count % 10 == 0:
-                            self.wav_file._file.flush()
-                            os.fsync(self.wav_file._file.fileno())
-                
-                # Convert to numpy array for processing
-                audio_array = np.frombuffer(audio_data, dtype=np.int16)
-                audio_array = audio_array.reshape(-1, self.channels)
-                
-                # Keep minimal backup in memory (last 1000 frames only)
-                self.raw_audio_data.append(audio_data)
-                if len(self.raw_audio_data) > 1000:
-                    self.raw_audio_data.pop(0)
-                
-                # Get current DOA from separate thread
-                with self.doa_lock:
-                    doa_angle = self.current_doa
+                # The PCM goes straight to the file; close() fixes up the
+                # RIFF sizes once
+                with wav_lock:
+                    wav_file = self.wav_file
+                    if wav_file:
+                        wav_file.write(audio_array)
+                        # Hand the buffered PCM to the kernel every couple of
+                        # seconds; fsync only happens at checkpoints
+                        now = monotonic()
+                        if now - last_flush > flush_interval:
+                            wav_file.flush()
+                            last_flush = now
+
+                aac_queue = self._aac_queue
+                if aac_queue is not None:
+                    try:
+                        # Copy out of the ring slot, which is reused
+                        aac_queue.put_nowait(audio_array.tobytes())
+                    except queue.Full:
+                        self._aac_dropped += 1
+
+                # Poll DOA every few chunks instead of from a dedicated thread
+                if has_doa and frame_count % doa_poll_frames == 0:
+                    doa_angle = poll_doa()
                 
                 # **REAL-TIME DOA LOGGING**
                 doa_log_counter += 1
                 if doa_log_counter % doa_record_interval == 0:
-                    doa_entry = {
-                        'timestamp': timestamp,
-                        'frame': frame_count,
-                        'doa_angle': doa_angle,
-                        'audio_level': float(np.mean(np.abs(audio_array)))
-                    }
-                    
-                    # Write DOA entry immediately to file
-                    with self.doa_file_lock:
-                        if self.doa_file:
-                            json.dump(doa_entry, self.doa_file)
-                            self.doa_file.write('\n')
-                            self.doa_file.flush()
-                            os.fsync(self.doa_file.fileno())
-                    
-                    # Keep minimal backup in memory
-                    self.doa_data.append(doa_entry)
-                    if len(self.doa_data) > 100:
-                        self.doa_data.pop(0)
+                    audio_level = float(mean_abs(audio_array.reshape(-1), level_scratch))
+                    i = self._doa_batch_len
+                    doa_ts[i] = timestamp
+                    doa_frame[i] = frame_count
+                    doa_angles[i] = -1 if doa_angle is None else doa_angle
+                    doa_level[i] = audio_level
+                    self._doa_batch_len = i + 1
+                    if i + 1 == doa_batch_size:
+                        self._flush_doa_batch()
                 
                 # Stream to SSH laptop if connected
                 if self.ssh_connected:
-                    doa_entry_temp = {
-                        'timestamp': timestamp,
-                        'frame': frame_count,
-                        'doa_angle': doa_angle,
-                        'audio_level': float(np.mean(np.abs(audio_array)))
-                    }
-                    self._stream_to_ssh(audio_array, doa_entry_temp)
+                    if audio_level is None:
+                        audio_level = float(mean_abs(audio_array.reshape(-1), level_scratch))
+                    stream_to_ssh(audio_array, timestamp, frame_count, doa_angle, audio_level)
                 
                 frame_count += 1
                 
                 # **CHECKPOINT SAVING**
                 self.checkpoint_counter += 1
-                if self.checkpoint_counter % self.checkpoint_interval == 0:
+                if self.checkpoint_counter % checkpoint_interval == 0:
                     self._save_checkpoint(frame_count)
                 
                 # Status logging
                 if frame_count % log_interval == 0:
-                    print(f"Audio capture: {frame_count} frames, DOA: {doa_angle}°, File size: {self._get_file_size_mb():.2f} MB")
+                    print(f"Audio capture: {frame_count} frames, DOA: {doa_angle}°, File size: {self._get_file_size_mb():.2f} MB, Dropped: {self._ring_dropped}, SSH dropped: {self._ssh_dropped}")
                 
             except Exception as e:
                 if frame_count % 300 == 0:
                     print(f"Capture error: {e}")
-                time.sleep(0.001)
+            finally:
+                # Release the slot back to the callback
+                self._ring_read += 1
+        
+        self._flush_doa_batch()
     
-    def _stream_to_ssh(self, audio_array, doa_entry):
-        """Stream audio and DOA data to SSH laptop"""
-        try:
-            import json
-            # Prepare data packet
-            packet = {
-                'type': 'respeaker_data',
-                'timestamp': doa_entry['timestamp'],
-                'doa_angle': doa_entry['doa_angle'],
-                'audio_level': doa_entry['audio_level'],
-                'audio_shape': audio_array.shape,
-                'audio_data': audio_array.tobytes().hex()
-            }
-            
-            # Send as JSON
-            json_data = json.dumps(packet) + '\n'
-            self.ssh_socket.sendall(json_data.encode('utf-8'))
-            
-        except Exception as e:
-            # SSH错误日志：每600次打印一次 (约1分钟)
-            if not hasattr(self, '_ssh_error_count'):
-                self._ssh_error_count = 0
-            self._ssh_error_count += 1
-            
-            if self._ssh_error_count % 600 == 1:
-                print(f"SSH streaming error: {e}")
+    def _flush_doa_batch(self):
+        """Write the staged DOA entries to the log in one write"""
+        n = self._doa_batch_len
+        if not n:
+            return
+        
+        if self.doa_log_format == 'binary':
+            pack = _DOA_REC.pack
+            data = b''.join([
+                pack(ts, frame, doa, level)
+                for ts, frame, doa, level in zip(
+                    self._doa_ts[:n].tolist(), self._doa_frame[:n].tolist(),
+                    self._doa_angle[:n].tolist(), self._doa_level[:n].tolist()
+                )
+            ])
+            self._doa_batch_len = 0
             
-            self.ssh_connected = False
+            with self.doa_file_lock:
+                if self.doa_file:
+                    self.doa_file.write(data)
+                    self.doa_entry_count += n
+            return
+        
+        # Same compact layout json.dumps(separators=(',', ':')) produces
+        lines = [
+            f'{{"timestamp":{ts!r},"frame":{frame},"doa_angle":{"null" if doa < 0 else doa},"audio_level":{level!r}}}\n'
+            for ts, frame, doa, level in zip(
+                self._doa_ts[:n].tolist(), self._doa_frame[:n].tolist(),
+                self._doa_angle[:n].tolist(), self._doa_level[:n].tolist()
+            )
+        ]
+        self._doa_batch_len = 0
+        
+        with self.doa_file_lock:
+            if self.doa_file:
+                self.doa_file.write(''.join(lines))
+                self.doa_entry_count += n
+    
+    def _stream_to_ssh(self, audio_array, timestamp, frame, doa_angle, audio_level):
+        """Queue audio and DOA data for the SSH worker process"""
+        if not self._ssh_alive.is_set():
+            # Worker lost the laptop connection and exited
+            self._set_ssh_connected(False)
+            return
+        
+        try:
+            self._ssh_queue.put_nowait((timestamp, frame, doa_angle, audio_level, audio_array.tobytes()))
+        except queue.Full:
+            self._ssh_dropped += 1
+    
+    def _feed_ssh_worker(self):
+        """Forward queued chunks to the SSH worker process until a None sentinel"""
+        conn = self._ssh_conn
+        try:
+            while True:
+                chunk = self._ssh_queue.get()
+                conn.send(chunk)
+                if chunk is None:
+                    break
+        except OSError:
+            # Worker exited; _stream_to_ssh sees _ssh_alive cleared
+            pass
+        finally:
+            conn.close()
+    
+    def _stop_ssh_sender(self):
+        """Let the SSH worker finish the queued chunks and exit"""
+        if not self._ssh_process:
+            return
+        try:
+            self._ssh_queue.put(None, timeout=1)
+        except queue.Full:
+            pass
+        self._ssh_feeder.join(timeout=2)
+        self._ssh_process.join(timeout=2)
+        if self._ssh_process.is_alive():
+            self._ssh_process.terminate()
+        self._ssh_feeder = None
+        self._ssh_process = None
     
     def _save_checkpoint(self, frame_count):
         """Save checkpoint information"""
@@ -414,10 +941,20 @@ class ReSpeakerController:
             checkpoint_info = {
                 'timestamp': time.time(),
                 'frame_count': frame_count,
-                'file_size_bytes': os.path.getsize(self.raw_audio_file) if os.path.exists(self.raw_audio_file) else 0,
+                'file_size_bytes': self._get_file_size_bytes(),
                 'recording_duration_seconds': frame_count * self.chunk_size / self.rate
             }
             
+            # Make everything up to this checkpoint durable on the SD card
+            with self.wav_file_lock:
+                if self.wav_file:
+                    self.wav_file.flush()
+                    os.fsync(self.wav_file.fileno())
+            with self.doa_file_lock:
+                if self.doa_file:
+                    self.doa_file.flush()
+                    os.fsync(self.doa_file.fileno())
+            
             checkpoint_file = self.raw_audio_file.replace('.wav', '_checkpoint.json')
             with open(checkpoint_file, 'w') as f:
                 json.dump(checkpoint_info, f, indent=2)
@@ -427,21 +964,26 @@ class ReSpeakerController:
         except Exception as e:
             print(f"Error saving checkpoint: {e}")
     
+    def _get_file_size_bytes(self):
+        """Get current WAV size from the writer's byte count (no stat() call)"""
+        wav_file = self.wav_file
+        return wav_file.size if wav_file else self._wav_size
+    
     def _get_file_size_mb(self):
         """Get current file size in MB"""
-        try:
-            if os.path.exists(self.raw_audio_file):
-                return os.path.getsize(self.raw_audio_file) / 1024 / 1024
-        except:
-            pass
-        return 0.0
+        return self._get_file_size_bytes() / 1024 / 1024
     
-    def get_current_doa(self):
-        """Get current DOA reading for status updates"""
-        if self.Mic_tuning and self.is_capturing:
-            with self.doa_lock:
-                return self.current_doa
-        return None
+    def get_current_doa(self, max_age=None):
+        """Get current DOA reading for status updates
+        
+        With max_age (seconds), a reading older than that is reported as None.
+        """
+        if not (self.Mic_tuning and self.is_capturing):
+            return None
+        if max_age is None:
+            return self.current_doa
+        doa_value, read_at = self.current_doa_sample
+        return doa_value if time.monotonic() - read_at <= max_age else None
     
     def stop_capture(self):
         """Stop capturing and properly close files"""
@@ -449,25 +991,28 @@ class ReSpeakerController:
             return
             
         print("Stopping real-time capture...")
-        self.is_capturing = False
         
-        # Wait for capture thread to finish
-        if hasattr(self, 'capture_thread'):
-            self.capture_thread.join(timeout=3)
-        
-        # Stop audio stream
+        # Stop audio stream first so no more chunks enter the ring
         if self.stream:
             self.stream.stop_stream()
             self.stream.close()
             self.stream = None
         
+        # Let the drain thread flush what's left in the ring
+        self.is_capturing = False
+        self._ring_ready.set()
+        if hasattr(self, 'capture_thread'):
+            self.capture_thread.join(timeout=3)
+        
+        self._stop_aac_encoder()
+        
         # **PROPERLY CLOSE FILES**
         with self.wav_file_lock:
             if self.wav_file:
                 try:
+                    self._wav_size = self.wav_file.size
                     self.wav_file.close()
-                    file_size = os.path.getsize(self.raw_audio_file) / 1024 / 1024
-                    print(f"WAV file closed: {self.raw_audio_file} ({file_size:.2f} MB)")
+                    print(f"WAV file closed: {self.raw_audio_file} ({self._get_file_size_mb():.2f} MB)")
                 except Exception as e:
                     print(f"Error closing WAV file: {e}")
                 finally:
@@ -499,7 +1044,7 @@ class ReSpeakerController:
                     'audio_file': self.raw_audio_file,
                     'doa_file': self.doa_log_file,
                     'audio_size_mb': self._get_file_size_mb(),
-                    'doa_entries': len(self.doa_data)
+                    'doa_entries': self.doa_entry_count
                 }
             }
             
@@ -518,12 +1063,8 @@ class ReSpeakerController:
         if self.is_capturing:
             self.stop_capture()
         
-        # Stop DOA thread
-        if self.Mic_tuning:
-            self.Mic_tuning = None
-            
-        if hasattr(self, 'doa_thread') and self.doa_thread:
-            self.doa_thread.join(timeout=2)
+        # Release DOA access
+        self.Mic_tuning = None
         
         # Ensure files are closed
         with self.wav_file_lock:
@@ -544,21 +1085,213 @@ class ReSpeakerController:
         
         if self.audio:
             self.audio.terminate()
+        self._stop_ssh_sender()
         if self.ssh_socket:
             self.ssh_socket.close()
         
         print("ReSpeakerController cleanup completed")
 
 
+V4L2_SYSFS_DIR = "/sys/class/video4linux"
+STDERR_TAIL_BYTES = 4096
+# How long a freshly started recorder must survive before it counts as running
+RECORDER_STARTUP_CHECK = 0.25
+
+
+def _wait_alive(process, timeout=RECORDER_STARTUP_CHECK):
+    """True if process is still running after timeout seconds (returns early if it exits)"""
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return True
+    return False
+
+
+def _read_sysfs(path):
+    """Read a sysfs attribute, or None if it doesn't exist"""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _scan_usb_video_nodes():
+    """List (device, name) of USB camera capture nodes from sysfs
+    
+    A UVC camera exposes its capture node with index 0 and its metadata node
+    with index 1, so only index-0 nodes are returned. Non-USB nodes (e.g. the
+    Pi's codec/ISP devices) are skipped.
+    """
+    entries = [e for e in os.listdir(V4L2_SYSFS_DIR) if e.startswith('video') and e[5:].isdigit()]
+    nodes = []
+    for entry in sorted(entries, key=lambda e: int(e[5:])):
+        node_dir = os.path.join(V4L2_SYSFS_DIR, entry)
+        if '/usb' not in os.path.realpath(os.path.join(node_dir, 'device')):
+            continue
+        if _read_sysfs(os.path.join(node_dir, 'index')) not in (None, '0'):
+            continue
+        nodes.append((f'/dev/{entry}', _read_sysfs(os.path.join(node_dir, 'name')) or ''))
+    return nodes
+
+
+# PyAV preview: packets queued ahead of a slow link (~1 s at 25 fps) and the
+# TCP connect/write timeout
+PYAV_PREVIEW_QUEUE = 25
+PYAV_PREVIEW_TIMEOUT_US = 2000000
+
+
+def _add_stream_like(container, template):
+    """Add an output stream copying template's codec parameters (no re-encode)"""
+    if hasattr(container, 'add_stream_from_template'):  # PyAV >= 14
+        return container.add_stream_from_template(template)
+    return container.add_stream(template=template)
+
+
+def _close_quietly(container):
+    try:
+        container.close()
+    except (av.error.FFmpegError, OSError):
+        pass
+
+
+_H264_ENCODERS = ('h264_v4l2m2m', 'libx264')
+_h264_encoder = None
+
+
+def _find_h264_encoder():
+    """Pick the Pi's hardware H.264 encoder if this ffmpeg has it, else libx264 (probed once)"""
+    global _h264_encoder
+    if _h264_encoder is None:
+        try:
+            result = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'],
+                                    capture_output=True, text=True, timeout=5)
+            encoders = result.stdout
+        except (OSError, subprocess.TimeoutExpired):
+            encoders = ''
+        _h264_encoder = 'h264_v4l2m2m' if ' h264_v4l2m2m ' in encoders else 'libx264'
+        logger.info("H.264 encoder: %s", _h264_encoder)
+    return _h264_encoder
+
+
+def _video_encode_options(codec):
+    """(option, value) pairs for the recorded video stream"""
+    options = [('-c:v', codec)]
+    if codec in _H264_ENCODERS:
+        options += [('-pix_fmt', 'yuv420p'), ('-b:v', '2M'), ('-g', '50')]
+    if codec == 'libx264':
+        options.append(('-preset', 'ultrafast'))
+    return options
+
+
+def _ffmpeg_record_cmd(device, output_file, input_format='mjpeg', framerate='25',
+                       video_size='1024x768', codec='copy', container='avi', stream=None):
+    """Build the ffmpeg command recording a v4l2 camera into output_file
+    
+    container 'mp4' writes fragmented MP4 (readable even if ffmpeg is killed).
+    If stream is a (host, port) tuple the camera is still opened only once: a
+    second, scaled 512x384@15 MJPEG encode of the same input goes to a tee
+    slave that sends it to that address. The slave uses onfail=ignore so a
+    lost laptop connection never stops the recording, and runs behind its own
+    fifo muxer thread that drops preview packets on overflow, so a slow but
+    still-connected link can't block the mux (and with it the file write).
+    """
+    cmd = [
+        'ffmpeg',
+        '-f', 'v4l2',
+        '-input_format', input_format,
+        '-framerate', framerate,
+        '-video_size', video_size,
+        '-i', device,
+        '-y'
+    ]
+    encode_options = _video_encode_options(codec)
+    movflags = '+frag_keyframe+empty_moov'
+    
+    if not stream:
+        for option, value in encode_options:
+            cmd += [option, value]
+        cmd += ['-f', container]
+        if container == 'mp4':
+            cmd += ['-movflags', movflags]
+        return cmd + [output_file]
+    
+    # Same options scoped to the first of the two mapped streams
+    cmd += ['-map', '0:v', '-map', '0:v']
+    for option, value in encode_options:
+        cmd += [option + (':0' if option.endswith(':v') else ':v:0'), value]
+    file_slave = f'f={container}'
+    if container == 'mp4':
+        file_slave += f':movflags={movflags}'
+    
+    stream_host, stream_port = stream
+    return cmd + [
+        '-filter:v:1', 'scale=512:384,fps=15',
+        '-c:v:1', 'mjpeg', '-q:v:1', '5',
+        '-f', 'tee',
+        f'[select=0:{file_slave}]{output_file}|'
+        f'[select=1:f=mjpeg:onfail=ignore:use_fifo=1:fifo_options=drop_pkts_on_overflow=1]'
+        f'tcp://{stream_host}:{stream_port}'
+    ]
+
+
+# v4l2 controls applied per camera mode. Order matters: the auto modes must be
+# off before the manual values stick.
+EXPOSURE_PROFILES = {
+    'indoor': {},  # camera defaults (auto exposure)
+    'outdoor': {   # reduced exposure for bright conditions
+        'exposure_auto': 1,
+        'exposure_absolute': 40,
+        'gain_automatic': 0,
+        'gain': 0,
+        'white_balance_temperature_auto': 0,
+        'white_balance_temperature': 5500
+    }
+}
+
+
 class VideoStreamer:
-    """Handles dual USB camera video recording using ffmpeg (lightweight for Raspberry Pi)"""
+    """Handles dual USB camera video recording using ffmpeg (lightweight for Raspberry Pi)
     
-    def __init__(self):
+    mode selects the EXPOSURE_PROFILES entry; non-indoor recordings get the
+    mode as a filename suffix (e.g. _camera1_outdoor.avi).
+    """
+    
+    def __init__(self, backend='ffmpeg', video_codec='copy', mode='indoor'):
         self.is_streaming = False
         self.is_recording = False
         self.ffmpeg_processes = []
         self.camera_devices = []
         self.output_files = []
+        self.streaming_cameras = set()  # cameras streamed by their recording pipeline
+        self.preview_processes = []  # GStreamer preview pipelines reading a recorder's shmsink
+        self.monitor_thread = None
+        self._stderr_tails = {}  # process -> last STDERR_TAIL_BYTES of its stderr
+        self.capture_threads = []  # in-process PyAV copy loops
+        self._capture_stop = threading.Event()
+        
+        # 'gstreamer' records MJPEG straight into Matroska via gst-launch-1.0,
+        # 'pyav' muxes the MJPEG packets into AVI from this process
+        self.backend = backend
+        if self.backend == 'gstreamer' and not shutil.which('gst-launch-1.0'):
+            logger.warning("gst-launch-1.0 not found, recording with ffmpeg")
+            self.backend = 'ffmpeg'
+        if self.backend == 'pyav' and not AV_AVAILABLE:
+            logger.warning("PyAV not installed, recording with ffmpeg")
+            self.backend = 'ffmpeg'
+        
+        # ffmpeg backend: 'copy' keeps the camera's MJPEG in AVI, 'h264'
+        # re-encodes into fragmented MP4 (~10x smaller, costs an MJPEG decode)
+        self.video_codec = video_codec
+        
+        self.mode = mode
+        self._file_suffix = '' if mode == 'indoor' else f'_{mode}'
+    
+    def _ffmpeg_output(self, output_dir, name):
+        """(output_file, codec, container) for the ffmpeg backend"""
+        if self.video_codec == 'h264':
+            return os.path.join(output_dir, f"{name}.mp4"), _find_h264_encoder(), 'mp4'
+        return os.path.join(output_dir, f"{name}.avi"), 'copy', 'avi'
         
     @property
     def cameras(self):
@@ -566,546 +1299,541 @@ class VideoStreamer:
         return self.camera_devices
         
     def find_cameras(self):
-        """Find available USB cameras in /dev/video*"""
-        print("Searching for USB cameras...")
-        available_cameras = []
+        """Find available USB cameras by scanning /sys/class/video4linux"""
+        logger.info("Searching for USB cameras...")
         
         try:
-            # Use v4l2-ctl --list-devices to find cameras properly
-            result = subprocess.run(
-                ['v4l2-ctl', '--list-devices'],
-                capture_output=True, text=True, timeout=2
-            )
-            
-            if result.returncode == 0:
-                lines = result.stdout.strip().split('\n')
-                current_device = None
-                
-                for line in lines:
-                    # Check for HD USB Camera entries
-                    if 'HD USB Camera' in line and 'usb-' in line:
-                        current_device = 'HD USB Camera'
-                        print(f"Found: {line.strip()}")
-                    elif current_device == 'HD USB Camera' and line.strip().startswith('/dev/video'):
-                        device = line.strip()
-                        # For each camera, typically video0/video2 are the main devices
-                        # and video1/video3 are metadata devices
-                        if device in ['/dev/video0', '/dev/video2']:
-                            available_cameras.append(device)
-                            print(f"  Using main device: {device}")
-                    elif line.strip() == '':
-                        current_device = None
-                        
-                if len(available_cameras) >= 2:
-                    return available_cameras[:2]
-                    
-            # Fallback: if v4l2-ctl fails or doesn't find both cameras
-            if len(available_cameras) < 2:
-                print("Fallback: checking /dev/video0 through /dev/video3")
-                for i in range(4):
-                    device = f'/dev/video{i}'
-                    if os.path.exists(device) and device not in available_cameras:
-                        try:
-                            # Quick test to see if device is usable
-                            test_cmd = ['v4l2-ctl', '-d', device, '--all']
-                            test_result = subprocess.run(test_cmd, capture_output=True, text=True, timeout=1)
-                            
-                            if 'HD USB Camera' in test_result.stdout or i in [0, 2]:
-                                available_cameras.append(device)
-                                print(f"  Added: {device}")
-                                
-                                if len(available_cameras) >= 2:
-                                    break
-                        except:
-                            pass
-                            
-        except Exception as e:
-            print(f"Error during camera detection: {e}")
+            nodes = _scan_usb_video_nodes()
+        except OSError as e:
+            logger.error("Error during camera detection: %s", e)
             # Ultimate fallback
-            print("Using default devices /dev/video0 and /dev/video2")
-            available_cameras = ['/dev/video0', '/dev/video2']
+            logger.warning("Using default devices /dev/video0 and /dev/video2")
+            return ['/dev/video0', '/dev/video2']
         
-        print(f"Selected cameras: {available_cameras}")
+        available_cameras = []
+        for device, name in nodes:
+            if 'HD USB Camera' in name:
+                available_cameras.append(device)
+                logger.info("Found: %s -> %s", name, device)
+        
+        # Fallback: any other USB capture node
+        if len(available_cameras) < 2:
+            for device, name in nodes:
+                if device not in available_cameras:
+                    available_cameras.append(device)
+                    logger.info("  Added: %s (%s)", device, name)
+        
+        available_cameras = available_cameras[:2]
+        logger.info("Selected cameras: %s", available_cameras)
         return available_cameras
     
     def initialize_cameras(self):
-        """Initialize cameras - just find and store device paths"""
+        """Initialize cameras - find device paths and apply the mode's exposure settings"""
         self.camera_devices = self.find_cameras()
         
+        controls = EXPOSURE_PROFILES[self.mode]
+        if controls:
+            # One v4l2-ctl call per camera for all controls
+            control_arg = ','.join(f'{name}={value}' for name, value in controls.items())
+            for device in self.camera_devices:
+                try:
+                    subprocess.run(['v4l2-ctl', '-d', device, '-c', control_arg], check=True)
+                    logger.info("Applied %s settings to %s", self.mode, device)
+                except (OSError, subprocess.CalledProcessError) as e:
+                    logger.warning("Could not apply all %s settings to %s: %s", self.mode, device, e)
+        
         if len(self.camera_devices) < 2:
-            print(f"Warning: Only {len(self.camera_devices)} camera(s) found, expected 2")
+            logger.warning("Only %s camera(s) found, expected 2", len(self.camera_devices))
         
         return len(self.camera_devices) > 0
     
-    def start_recording(self, output_dir, filename_prefix):
-        """Start recording video from both cameras using ffmpeg"""
+    def start_recording(self, output_dir, filename_prefix, stream_host=None, stream_base_port=8888):
+        """Start recording video from both cameras using ffmpeg
+        
+        With a stream_host, each camera is opened once and tee'd into both
+        the file and the TCP preview stream.
+        """
         if self.is_recording:
             return False
         
         if not self.camera_devices:
-            print("No cameras initialized")
+            logger.warning("No cameras initialized")
             return False
         
         self.ffmpeg_processes = []
+        self.capture_threads = []
+        self._capture_stop.clear()
         self.output_files = []
+        self.streaming_cameras = set()
         
         for i, device in enumerate(self.camera_devices):
-            output_file = os.path.join(output_dir, f"{filename_prefix}_camera{i+1}.avi")
+            if self.backend == 'pyav':
+                output_file = os.path.join(output_dir, f"{filename_prefix}_camera{i+1}{self._file_suffix}.avi")
+                stream = (stream_host, stream_base_port + i) if stream_host else None
+                if self._start_pyav_recording(i, device, output_file, stream):
+                    self.output_files.append(output_file)
+                    continue
+                logger.warning("PyAV capture failed for camera %s, falling back to ffmpeg", i+1)
+            
+            if self.backend == 'gstreamer':
+                output_file = os.path.join(output_dir, f"{filename_prefix}_camera{i+1}{self._file_suffix}.mkv")
+                if stream_host and self._start_gstreamer_recording(
+                        i, device, output_file, stream=(stream_host, stream_base_port + i)):
+                    self.output_files.append(output_file)
+                    self.streaming_cameras.add(i)
+                    continue
+                if self._start_gstreamer_recording(i, device, output_file):
+                    self.output_files.append(output_file)
+                    continue
+                logger.warning("GStreamer pipeline failed for camera %s, falling back to ffmpeg", i+1)
+            
+            output_file, codec, container = self._ffmpeg_output(
+                output_dir, f"{filename_prefix}_camera{i+1}{self._file_suffix}")
             self.output_files.append(output_file)
+            stream = (stream_host, stream_base_port + i) if stream_host else None
             
-            # First try with MJPEG input format
-
-            ffmpeg_cmd = [
-                'ffmpeg',
-                '-f', 'v4l2',
-                '-input_format', 'mjpeg',
-                '-framerate', '25',
-                '-video_size', '1024x768',
-                '-i', device,
-                '-c:v', 'copy',              # 直接复制MJPEG流
-                '-f', 'avi',                 # 明确指定AVI容器
-                '-y',
-                output_file
-            ]
+            # First try with MJPEG input format (直接复制MJPEG流)
+            ffmpeg_cmd = _ffmpeg_record_cmd(device, output_file, codec=codec,
+                                            container=container, stream=stream)
             
             try:
                 # Start ffmpeg process
-                process = subprocess.Popen(
-                    ffmpeg_cmd,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.DEVNULL,  # Discard stdout to prevent blocking
-                    stderr=subprocess.DEVNULL   # Discard stderr to prevent blocking
-                )
+                process = self._popen_recorder(ffmpeg_cmd)
                 
                 # Check if process started successfully
-                time.sleep(0.5)
-                if process.poll() is None:
+                if _wait_alive(process):
                     self.ffmpeg_processes.append(process)
-                    print(f"Started recording camera {i+1} ({device}) to {output_file}")
+                    logger.info("Started recording camera %s (%s) to %s", i+1, device, output_file)
+                    if stream:
+                        self.streaming_cameras.add(i)
+                        logger.info("Camera %s streaming to %s:%s from the same capture", i+1, stream[0], stream[1])
                 else:
                     raise Exception("FFmpeg process died immediately")
                 
             except Exception as e:
-                print(f"Failed with MJPEG format, trying YUYV: {e}")
+                logger.warning("Failed with MJPEG format, trying YUYV: %s", e)
                 
-                # Try with YUYV format
-                ffmpeg_cmd[4] = 'yuyv422'  # Change input format
-                ffmpeg_cmd[8] = '640x480'  # Lower resolution for YUYV
-                ffmpeg_cmd[6] = '9'        # 9 fps for YUYV as per spec
+                # Try with YUYV format, lower resolution, 9 fps as per spec
+                ffmpeg_cmd = _ffmpeg_record_cmd(device, output_file, input_format='yuyv422',
+                                                framerate='9', video_size='640x480', codec=codec,
+                                                container=container, stream=stream)
                 
                 try:
-                    process = subprocess.Popen(
-                        ffmpeg_cmd,
-                        stdin=subprocess.PIPE,
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL
-                    )
+                    process = self._popen_recorder(ffmpeg_cmd)
                     
-                    time.sleep(0.5)
-                    if process.poll() is None:
+                    if _wait_alive(process):
                         self.ffmpeg_processes.append(process)
-                        print(f"Started recording camera {i+1} with YUYV format")
+                        logger.info("Started recording camera %s with YUYV format", i+1)
+                        if stream:
+                            self.streaming_cameras.add(i)
                     else:
                         raise Exception("FFmpeg process died immediately")
                         
                 except Exception as e2:
-                    print(f"Failed with hardware encoding, trying software: {e2}")
+                    logger.warning("Failed with hardware encoding, trying software: %s", e2)
                     
                     # Try software encoding
-                    ffmpeg_cmd[10] = 'libx264'  # Change to software encoder
+                    ffmpeg_cmd = _ffmpeg_record_cmd(device, output_file, input_format='yuyv422',
+                                                    framerate='9', video_size='640x480',
+                                                    codec='libx264', container=container,
+                                                    stream=stream)
                     
                     try:
-                        process = subprocess.Popen(
-                            ffmpeg_cmd,
-                            stdin=subprocess.PIPE,
-                            stdout=subprocess.DEVNULL,
-                            stderr=subprocess.PIPE  # Keep stderr for debugging
-                        )
+                        process = self._popen_recorder(ffmpeg_cmd)
                         
-                        time.sleep(0.5)
-                        if process.poll() is None:
+                        if _wait_alive(process):
                             self.ffmpeg_processes.append(process)
-                            print(f"Started recording camera {i+1} with software encoding")
+                            logger.info("Started recording camera %s with software encoding", i+1)
+                            if stream:
+                                self.streaming_cameras.add(i)
                         else:
                             # Print stderr for debugging
-                            stderr_output = process.stderr.read().decode('utf-8')
-                            print(f"FFmpeg error: {stderr_output}")
+                            self._drain_stderr(process)
+                            logger.error("FFmpeg error: %s", self._stderr_tail_text(process))
                             
                     except Exception as e3:
-                        print(f"Failed completely for camera {i+1}: {e3}")
+                        logger.error("Failed completely for camera %s: %s", i+1, e3)
         
-        self.is_recording = len(self.ffmpeg_processes) > 0
+        self.is_recording = len(self.ffmpeg_processes) + len(self.capture_threads) > 0
         
         # Start monitoring thread
-        if self.is_recording:
+        if self.ffmpeg_processes:
             self.monitor_thread = threading.Thread(target=self._monitor_recording)
             self.monitor_thread.daemon = True
             self.monitor_thread.start()
         
         return self.is_recording
     
-    def _monitor_recording(self):
-        """Monitor ffmpeg processes in background"""
-        time.sleep(3)  # Initial delay
+    def _start_gstreamer_recording(self, i, device, output_file, stream=None):
+        """Record the camera's MJPEG stream into Matroska without re-encoding
+        
+        If stream is a (host, port) tuple, a tee branch also hands the frames
+        to a shmsink, and a separate gst-launch process sends a downscaled
+        512x384@15 MJPEG preview from there to that address. A tcpclientsink
+        error would end the whole pipeline, so keeping it out of the recording
+        process means a lost laptop connection only ends the preview.
+        """
+        gst_cmd = [
+            'gst-launch-1.0', '-e',                      # EOS on SIGINT so the file is finalized
+            'v4l2src', f'device={device}', 'io-mode=4',  # dmabuf, no copy out of the UVC buffers
+            '!', 'image/jpeg,width=1024,height=768,framerate=25/1',
+            '!', 'tee', 'name=t',
+            't.', '!', 'queue',
+            '!', 'matroskamux',
+            '!', 'filesink', f'location={output_file}'
+        ]
+        shm_path = None
+        if stream:
+            shm_path = os.path.join(tempfile.gettempdir(), f'robff-preview-{os.getpid()}-{i}')
+            try:
+                os.unlink(shm_path)  # left over from a crashed run
+            except FileNotFoundError:
+                pass
+            gst_cmd += [
+                # Leaky queue: a slow or absent preview never stalls the file
+                # branch, and shmsink doesn't fail when its reader goes away
+                't.', '!', 'queue', 'leaky=downstream', 'max-size-buffers=2',
+                '!', 'shmsink', f'socket-path={shm_path}',
+                'wait-for-connection=false', 'sync=false'
+            ]
         
-        while self.is_recording:
-            for i, process in enumerate(self.ffmpeg_processes):
-                if process and process.poll() is not None:
-                    # Process terminated
-                    stderr_output = process.stderr.read().decode('utf-8')
-                    if stderr_output:
-                        print(f"\nCamera {i+1} ffmpeg error (exit code {process.returncode}):")
-                        print(stderr_output[-500:])  # Last 500 chars
-            
-            time.sleep(5)  # Check every 5 seconds
-    
-    def start_streaming(self, ssh_host, base_port=8888):
-        """Start streaming video to SSH laptop using ffmpeg"""
-        if self.is_streaming:
+        try:
+            process = self._popen_recorder(gst_cmd)
+        except OSError as e:
+            logger.warning("Failed to launch GStreamer for camera %s: %s", i+1, e)
             return False
         
-        if not self.camera_devices:
-            print("No cameras initialized")
+        if not _wait_alive(process):
             return False
         
-        # For streaming, we'll use ffmpeg to stream directly
-        # This is much more efficient than processing frames in Python
-        for i, device in enumerate(self.camera_devices):
-            stream_port = base_port + i
-            
-            # FFmpeg streaming command
-            ffmpeg_stream_cmd = [
-                'ffmpeg',
-                '-f', 'v4l2',
-                '-input_format', 'mjpeg',
-                '-framerate', '15',              # Lower framerate for streaming
-                '-video_size', '512x384',        # Lower resolution for streaming
-                '-i', device,
-                '-c:v', 'mjpeg',                 # Keep MJPEG for low latency
-                '-q:v', '5',                     # Quality setting
-                '-f', 'mjpeg',                   # Output format
-                f'tcp://{ssh_host}:{stream_port}'
-            ]
-            
-            try:
-                # Start streaming process in background
-                process = subprocess.Popen(
-                    ffmpeg_stream_cmd,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL
-                )
-                print(f"Camera {i+1} streaming to {ssh_host}:{stream_port}")
-                
-            except Exception as e:
-                print(f"Failed to start streaming camera {i+1}: {e}")
-        
-        self.is_streaming = True
+        self.ffmpeg_processes.append(process)
+        logger.info("Started recording camera %s (%s) to %s [GStreamer]", i+1, device, output_file)
+        if stream:
+            self._start_gstreamer_preview(i, shm_path, stream)
         return True
     
-    def stop_recording(self):
-        """Stop recording video"""
-        if not self.is_recording:
+    def _start_gstreamer_preview(self, i, shm_path, stream):
+        """Send a downscaled preview of a recording pipeline's shmsink to stream"""
+        stream_host, stream_port = stream
+        preview_cmd = [
+            'gst-launch-1.0',
+            'shmsrc', f'socket-path={shm_path}', 'is-live=true', 'do-timestamp=true',
+            '!', 'image/jpeg,width=1024,height=768,framerate=25/1',
+            '!', 'jpegdec', '!', 'videoscale', '!', 'videorate',
+            '!', 'video/x-raw,width=512,height=384,framerate=15/1',
+            '!', 'jpegenc', 'quality=75',
+            '!', 'tcpclientsink', f'host={stream_host}', f'port={stream_port}'
+        ]
+        try:
+            # Not monitored: its exit only ends the preview
+            process = subprocess.Popen(preview_cmd, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL)
+        except OSError as e:
+            logger.warning("Camera %s preview stream unavailable: %s", i+1, e)
             return
+        self.preview_processes.append(process)
+        logger.info("Camera %s streaming to %s:%s from the same capture", i+1, stream_host, stream_port)
+    
+    def _start_pyav_recording(self, i, device, output_file, stream=None):
+        """Open the camera with PyAV and copy its MJPEG packets into AVI
         
-        self.is_recording = False
+        Same result as ffmpeg -c:v copy without the extra process. If stream is
+        a (host, port) tuple, the same packets are also muxed to a TCP MJPEG
+        preview (full resolution, nothing is re-encoded) from their own thread.
+        """
+        try:
+            capture = av.open(device, format='v4l2', options={
+                'input_format': 'mjpeg',
+                'framerate': '25',
+                'video_size': '1024x768'
+            })
+        except (av.error.FFmpegError, OSError) as e:
+            logger.warning("Failed to open camera %s with PyAV: %s", i+1, e)
+            return False
         
-        # Stop all ffmpeg processes gracefully
-        for i, process in enumerate(self.ffmpeg_processes):
-            if process and process.poll() is None:  # Process is still running
-                try:
-                    process.terminate()
-                    process.wait(timeout=5)
-                except subprocess.TimeoutExpired:
-                    print(f"Camera {i+1} ffmpeg process didn't terminate gracefully, killing it")
-                    process.kill()
-                    process.wait()
+        try:
+            output = av.open(output_file, 'w', format='avi')
+            out_stream = _add_stream_like(output, capture.streams.video[0])
+        except (av.error.FFmpegError, OSError) as e:
+            logger.warning("Failed to create %s: %s", output_file, e)
+            capture.close()
+            return False
+        
+        preview = None
+        if stream:
+            # The copy loop only queues packets (dropping them when the queue
+            # is full), so a slow or unreachable laptop never holds up the file
+            preview = (queue.Queue(maxsize=PYAV_PREVIEW_QUEUE), threading.Event())
+            self.streaming_cameras.add(i)
+            threading.Thread(
+                target=self._pyav_preview_loop,
+                args=(i, stream, capture.streams.video[0]) + preview,
+                daemon=True
+            ).start()
+        
+        thread = threading.Thread(
+            target=self._pyav_copy_loop,
+            args=(i, capture, output, out_stream, preview),
+            daemon=True
+        )
+        thread.start()
+        self.capture_threads.append(thread)
+        logger.info("Started recording camera %s (%s) to %s [PyAV]", i+1, device, output_file)
+        return True
+    
+    def _pyav_copy_loop(self, i, capture, output, out_stream, preview):
+        """Mux every captured packet into the file (and queue it for the preview) until stopped"""
+        preview_packets = None
+        if preview:
+            preview_packets, preview_done = preview
+        try:
+            for packet in capture.demux(video=0):
+                if self._capture_stop.is_set():
+                    break
+                if packet.dts is None:  # demuxer flush packet
+                    continue
+                packet.stream = out_stream
+                output.mux(packet)
                 
-                # Check if there were any errors
-                if hasattr(process, 'stderr') and process.stderr:
+                if preview_packets is not None:
+                    if preview_done.is_set():  # the preview thread gave up
+                        preview_packets = None
+                        continue
                     try:
-                        stderr_output = process.stderr.read().decode('utf-8')
-                        if stderr_output:
-                            print(f"Camera {i+1} ffmpeg errors:\n{stderr_output[-500:]}")
-                    except:
+                        preview_packets.put_nowait(packet)
+                    except queue.Full:
                         pass
-        
-        self.ffmpeg_processes = []
-        
-        # Report file sizes
-        for output_file in self.output_files:
-            if os.path.exists(output_file):
-                size_mb = os.path.getsize(output_file) / 1024 / 1024
-                print(f"Video saved: {output_file} ({size_mb:.2f} MB)")
-        
-        print("Video recording stopped")
+        except (av.error.FFmpegError, OSError) as e:
+            if not self._capture_stop.is_set():
+                logger.error("Camera %s PyAV capture error: %s", i+1, e)
+        finally:
+            output.close()  # writes the AVI index
+            capture.close()
+            if preview:
+                preview_done.set()
     
-    def stop_streaming(self):
-        """Stop video streaming"""
-        # For now, streaming is handled by separate ffmpeg processes
-        # In production, you'd want to track and stop these processes
-        self.is_streaming = False
-        print("Video streaming stopped")
-    
-    def cleanup(self):
-        """Cleanup all resources"""
-        self.stop_recording()
-        self.stop_streaming()
-        self.camera_devices = []
-        self.output_files = []
-
-class VideoStreamer_outdoor:
-    """Outdoor version with reduced exposure for bright conditions"""
-    
-    def __init__(self):
-        self.is_streaming = False
-        self.is_recording = False
-        self.ffmpeg_processes = []
-        self.camera_devices = []
-        self.output_files = []
-        
-    @property
-    def cameras(self):
-        return self.camera_devices
-        
-    def find_cameras(self):
-        """Same as original VideoStreamer"""
-        print("Searching for USB cameras (OUTDOOR MODE)...")
-        available_cameras = []
-        
+    def _pyav_preview_loop(self, i, stream, template, packets, done):
+        """Connect to the preview address and mux queued packets into it until done"""
+        stream_host, stream_port = stream
         try:
-            result = subprocess.run(
-                ['v4l2-ctl', '--list-devices'],
-                capture_output=True, text=True, timeout=2
-            )
-            
-            if result.returncode == 0:
-                lines = result.stdout.strip().split('\n')
-                current_device = None
-                
-                for line in lines:
-                    if 'HD USB Camera' in line and 'usb-' in line:
-                        current_device = 'HD USB Camera'
-                        print(f"Found: {line.strip()}")
-                    elif current_device == 'HD USB Camera' and line.strip().startswith('/dev/video'):
-                        device = line.strip()
-                        if device in ['/dev/video0', '/dev/video2']:
-                            available_cameras.append(device)
-                            print(f"  Using main device: {device}")
-                    elif line.strip() == '':
-                        current_device = None
-                        
-                if len(available_cameras) >= 2:
-                    return available_cameras[:2]
-                    
-            if len(available_cameras) < 2:
-                print("Fallback: checking /dev/video0 through /dev/video3")
-                for i in range(4):
-                    device = f'/dev/video{i}'
-                    if os.path.exists(device) and device not in available_cameras:
-                        try:
-                            test_cmd = ['v4l2-ctl', '-d', device, '--all']
-                            test_result = subprocess.run(test_cmd, capture_output=True, text=True, timeout=1)
-                            
-                            if 'HD USB Camera' in test_result.stdout or i in [0, 2]:
-                                available_cameras.append(device)
-                                print(f"  Added: {device}")
-                                
-                                if len(available_cameras) >= 2:
-                                    break
-                        except:
-                            pass
-                            
-        except Exception as e:
-            print(f"Error during camera detection: {e}")
-            print("Using default devices /dev/video0 and /dev/video2")
-            available_cameras = ['/dev/video0', '/dev/video2']
+            # Connecting here keeps an unreachable laptop off the start path;
+            # timeout (microseconds) bounds the connect and each write
+            container = av.open(f'tcp://{stream_host}:{stream_port}', 'w', format='mjpeg',
+                                options={'timeout': str(PYAV_PREVIEW_TIMEOUT_US)})
+        except (av.error.FFmpegError, OSError) as e:
+            logger.warning("Camera %s preview stream unavailable: %s", i+1, e)
+            self.streaming_cameras.discard(i)
+            done.set()
+            return
         
-        print(f"Selected cameras (OUTDOOR MODE): {available_cameras}")
-        return available_cameras
+        try:
+            preview_stream = _add_stream_like(container, template)
+            logger.info("Camera %s streaming to %s:%s from the same capture", i+1, stream_host, stream_port)
+            while not done.is_set():
+                try:
+                    packet = packets.get(timeout=1)
+                except queue.Empty:
+                    continue
+                packet.stream = preview_stream
+                container.mux(packet)
+        except (av.error.FFmpegError, OSError) as e:
+            # A dropped laptop connection only ends the preview
+            logger.warning("Camera %s preview stream stopped: %s", i+1, e)
+            self.streaming_cameras.discard(i)
+        finally:
+            done.set()
+            _close_quietly(container)
     
-    def initialize_cameras(self):
-        """Initialize cameras and set outdoor exposure settings"""
-        self.camera_devices = self.find_cameras()
-        
-        # Apply outdoor exposure settings to each camera
-        for device in self.camera_devices:
-            try:
-                # Disable auto exposure
-                subprocess.run(['v4l2-ctl', '-d', device, '-c', 'exposure_auto=1'], check=True)
-                # Set manual exposure (lower value for outdoor)
-                subprocess.run(['v4l2-ctl', '-d', device, '-c', 'exposure_absolute=40'], check=True)
-                # Disable auto gain
-                subprocess.run(['v4l2-ctl', '-d', device, '-c', 'gain_automatic=0'], check=True)
-                # Set low gain
-                subprocess.run(['v4l2-ctl', '-d', device, '-c', 'gain=0'], check=True)
-                # Set white balance to daylight if available
-                subprocess.run(['v4l2-ctl', '-d', device, '-c', 'white_balance_temperature_auto=0'], check=True)
-                subprocess.run(['v4l2-ctl', '-d', device, '-c', 'white_balance_temperature=5500'], check=True)
-                
-                print(f"Applied outdoor settings to {device}")
-            except Exception as e:
-                print(f"Warning: Could not apply all outdoor settings to {device}: {e}")
-        
-        if len(self.camera_devices) < 2:
-            print(f"Warning: Only {len(self.camera_devices)} camera(s) found, expected 2")
-        
-        return len(self.camera_devices) > 0
+    def _popen_recorder(self, cmd):
+        """Start a recorder process whose stderr is drained by the monitor thread"""
+        process = subprocess.Popen(
+            _ionice_cmd(cmd),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,  # Discard stdout to prevent blocking
+            stderr=subprocess.PIPE
+        )
+        os.set_blocking(process.stderr.fileno(), False)
+        self._stderr_tails[process] = bytearray()
+        _pin_to_cpus(process.pid, RECORDER_CPUS)
+        _prioritize_recorder(process.pid)
+        return process
     
-    def start_recording(self, output_dir, filename_prefix):
-        """Same as original but with outdoor suffix in filename"""
-        if self.is_recording:
-            return False
-        
-        if not self.camera_devices:
-            print("No cameras initialized")
-            return False
-        
-        self.ffmpeg_processes = []
-        self.output_files = []
-        
-        for i, device in enumerate(self.camera_devices):
-            output_file = os.path.join(output_dir, f"{filename_prefix}_camera{i+1}_outdoor.avi")
-            self.output_files.append(output_file)
-            
-            ffmpeg_cmd = [
-                'ffmpeg',
-                '-f', 'v4l2',
-                '-input_format', 'mjpeg',
-                '-framerate', '25',
-                '-video_size', '1024x768',
-                '-i', device,
-                '-c:v', 'copy',
-                '-f', 'avi',
-                '-y',
-                output_file
-            ]
-            
+    def _drain_stderr(self, process):
+        """Move pending stderr output into the process's tail buffer
+        
+        Returns False once the pipe reaches EOF, i.e. the process has exited.
+        """
+        tail = self._stderr_tails.setdefault(process, bytearray())
+        fd = process.stderr.fileno()
+        while True:
             try:
-                process = subprocess.Popen(
-                    ffmpeg_cmd,
-                    stdin=subprocess.PIPE,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL
-                )
-                
-                time.sleep(0.5)
-                if process.poll() is None:
-                    self.ffmpeg_processes.append(process)
-                    print(f"Started recording camera {i+1} ({device}) to {output_file} [OUTDOOR MODE]")
-                else:
-                    raise Exception("FFmpeg process died immediately")
-                
-            except Exception as e:
-                print(f"Failed to start recording for camera {i+1}: {e}")
-        
-        self.is_recording = len(self.ffmpeg_processes) > 0
-        
-        if self.is_recording:
-            self.monitor_thread = threading.Thread(target=self._monitor_recording)
-            self.monitor_thread.daemon = True
-            self.monitor_thread.start()
-        
-        return self.is_recording
+                data = os.read(fd, 4096)
+            except BlockingIOError:
+                return True
+            except OSError:
+                return False
+            if not data:
+                return False
+            tail += data
+            del tail[:-STDERR_TAIL_BYTES]
+    
+    def _stderr_tail_text(self, process):
+        return self._stderr_tails.get(process, b'').decode('utf-8', 'replace')
     
     def _monitor_recording(self):
-        """Same as original"""
-        time.sleep(3)
-        
-        while self.is_recording:
+        """Drain recorder stderr in background and report processes that exit"""
+        with selectors.DefaultSelector() as selector:
             for i, process in enumerate(self.ffmpeg_processes):
-                if process and process.poll() is not None:
-                    stderr_output = process.stderr.read().decode('utf-8')
-                    if stderr_output:
-                        print(f"\nCamera {i+1} ffmpeg error (exit code {process.returncode}):")
-                        print(stderr_output[-500:])
+                selector.register(process.stderr, selectors.EVENT_READ, (i, process))
             
-            time.sleep(5)
+            while self.is_recording and selector.get_map():
+                for key, _ in selector.select(timeout=1):
+                    i, process = key.data
+                    if self._drain_stderr(process):
+                        continue
+                    
+                    # EOF on stderr: the process has exited
+                    selector.unregister(key.fileobj)
+                    if not self.is_recording:
+                        continue
+                    try:
+                        returncode = process.wait(timeout=1)
+                    except subprocess.TimeoutExpired:
+                        returncode = None
+                    logger.error("Camera %s ffmpeg error (exit code %s):\n%s",
+                                 i+1, returncode, self._stderr_tail_text(process)[-500:])  # Last 500 chars
     
     def start_streaming(self, ssh_host, base_port=8888):
-        """Same as original"""
+        """Start streaming video to SSH laptop using ffmpeg"""
         if self.is_streaming:
             return False
         
         if not self.camera_devices:
-            print("No cameras initialized")
+            logger.warning("No cameras initialized")
             return False
         
+        # For streaming, we'll use ffmpeg to stream directly
+        # This is much more efficient than processing frames in Python
         for i, device in enumerate(self.camera_devices):
             stream_port = base_port + i
             
+            # Already streamed from its recording pipeline; don't open the device twice
+            if i in self.streaming_cameras:
+                continue
+            
+            # FFmpeg streaming command
             ffmpeg_stream_cmd = [
                 'ffmpeg',
                 '-f', 'v4l2',
                 '-input_format', 'mjpeg',
-                '-framerate', '15',
-                '-video_size', '512x384',
+                '-framerate', '15',              # Lower framerate for streaming
+                '-video_size', '512x384',        # Lower resolution for streaming
                 '-i', device,
-                '-c:v', 'mjpeg',
-                '-q:v', '5',
-                '-f', 'mjpeg',
+                '-c:v', 'mjpeg',                 # Keep MJPEG for low latency
+                '-q:v', '5',                     # Quality setting
+                '-f', 'mjpeg',                   # Output format
                 f'tcp://{ssh_host}:{stream_port}'
             ]
             
             try:
+                # Start streaming process in background
                 process = subprocess.Popen(
                     ffmpeg_stream_cmd,
                     stdout=subprocess.DEVNULL,
                     stderr=subprocess.DEVNULL
                 )
-                print(f"Camera {i+1} streaming to {ssh_host}:{stream_port} [OUTDOOR MODE]")
+                logger.info("Camera %s streaming to %s:%s", i+1, ssh_host, stream_port)
                 
             except Exception as e:
-                print(f"Failed to start streaming camera {i+1}: {e}")
+                logger.warning("Failed to start streaming camera %s: %s", i+1, e)
         
         self.is_streaming = True
         return True
     
     def stop_recording(self):
-        """Same as original"""
+        """Stop recording video"""
         if not self.is_recording:
             return
         
         self.is_recording = False
         
+        # PyAV loops exit on the next packet (one frame period) and close their files
+        self._capture_stop.set()
+        for i, thread in enumerate(self.capture_threads):
+            thread.join(timeout=5)
+            if thread.is_alive():
+                logger.warning("Camera %s PyAV capture didn't stop within 5s", i+1)
+        self.capture_threads = []
+        
+        # Previews first, so they don't log the recorders' shmsinks going away
+        for process in self.preview_processes:
+            if process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=2)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+        self.preview_processes = []
+        
+        # Stop all ffmpeg processes gracefully (SIGINT: ffmpeg finalizes the
+        # container, gst-launch -e pushes EOS through the pipeline)
         for i, process in enumerate(self.ffmpeg_processes):
-            if process and process.poll() is None:
+            if process and process.poll() is None:  # Process is still running
                 try:
-                    process.terminate()
+                    process.send_signal(signal.SIGINT)
                     process.wait(timeout=5)
                 except subprocess.TimeoutExpired:
-                    print(f"Camera {i+1} ffmpeg process didn't terminate gracefully, killing it")
+                    logger.warning("Camera %s ffmpeg process didn't terminate gracefully, killing it", i+1)
                     process.kill()
                     process.wait()
-                
-                if hasattr(process, 'stderr') and process.stderr:
-                    try:
-                        stderr_output = process.stderr.read().decode('utf-8')
-                        if stderr_output:
-                            print(f"Camera {i+1} ffmpeg errors:\n{stderr_output[-500:]}")
-                    except:
-                        pass
+        
+        # The monitor wakes up on stderr EOF as the processes exit
+        if self.monitor_thread:
+            self.monitor_thread.join(timeout=2)
+            self.monitor_thread = None
+        
+        # Check if there were any errors (255: ffmpeg stopped by the signal)
+        for i, process in enumerate(self.ffmpeg_processes):
+            self._drain_stderr(process)
+            if process.returncode not in (0, 255):
+                logger.error("Camera %s ffmpeg errors:\n%s", i+1, self._stderr_tail_text(process)[-500:])
+            process.stderr.close()
         
         self.ffmpeg_processes = []
+        self._stderr_tails = {}
         
+        # Report file sizes
         for output_file in self.output_files:
-            if os.path.exists(output_file):
-                size_mb = os.path.getsize(output_file) / 1024 / 1024
-                print(f"Video saved: {output_file} ({size_mb:.2f} MB) [OUTDOOR MODE]")
+            try:
+                size_mb = os.stat(output_file).st_size / 1024 / 1024
+            except OSError:
+                continue
+            logger.info("Video saved: %s (%.2f MB)", output_file, size_mb)
         
-        print("Video recording stopped [OUTDOOR MODE]")
+        logger.info("Video recording stopped")
     
     def stop_streaming(self):
-        """Same as original"""
+        """Stop video streaming"""
+        # For now, streaming is handled by separate ffmpeg processes
+        # In production, you'd want to track and stop these processes
         self.is_streaming = False
-        print("Video streaming stopped [OUTDOOR MODE]")
+        logger.info("Video streaming stopped")
     
     def cleanup(self):
-        """Same as original"""
+        """Cleanup all resources"""
         self.stop_recording()
         self.stop_streaming()
         self.camera_devices = []
         self.output_files = []
 
+# Seconds stop_recording waits for all subsystems to shut down
+STOP_TIMEOUT = 15
+
+# Characters not allowed in a user ID (keeps letters, digits, '-' and '_')
+_USER_ID_RE = re.compile(r'[^\w-]+')
+
+
 class RecordingControl_v3:
     """Enhanced recording control that integrates with Flask web interface"""
     
@@ -1119,11 +1847,22 @@ class RecordingControl_v3:
 
         self.current_session_dir = None
         
+        # Status polled by the web UI is rebuilt at most every _status_ttl seconds
+        self._status_cache = (0.0, None)
+        self._status_ttl = 0.2
+        
+        # Subsystem state snapshotted at state transitions for the status
+        self._cached_respeaker_init = False
+        self._cached_ssh_connected = False
+        self._cached_video_streaming = False
+        self._cached_camera_count = 0
+        self._status_template = None
+        
         # ReSpeaker controller
         self.respeaker = ReSpeakerController()
         
         # Video streamer
-        # self.video_streamer = VideoStreamer_outdoor()
+        # self.video_streamer = VideoStreamer(mode='outdoor')
         self.video_streamer = VideoStreamer()
 
         
@@ -1133,22 +1872,49 @@ class RecordingControl_v3:
         # Initialize ReSpeaker
         if RESPEAKER_AVAILABLE:
             if self.respeaker.initialize():
-                print("ReSpeaker initialized successfully")
+                logger.info("ReSpeaker initialized successfully")
                 if self.ssh_host:
                     self.respeaker.setup_ssh_streaming(self.ssh_host, ssh_port=9999)
             else:
-                print("Failed to initialize ReSpeaker")
+                logger.warning("Failed to initialize ReSpeaker")
         else:
-            print("ReSpeaker not available, continuing without spatial audio")
+            logger.info("ReSpeaker not available, continuing without spatial audio")
         
         # Initialize cameras
         try:
             if self.video_streamer.initialize_cameras():
-                print("Cameras initialized successfully")
+                logger.info("Cameras initialized successfully")
             else:
-                print("Failed to initialize cameras")
+                logger.warning("Failed to initialize cameras")
         except Exception as e:
-            print(f"Error initializing cameras: {e}")
+            logger.error("Error initializing cameras: %s", e)
+        
+        # Start/stop steps resolved once from what initialized above; each
+        # start step is called with (session_dir, filename_prefix)
+        self._capture_audio = bool(RESPEAKER_AVAILABLE and self.respeaker.device_index)
+        self._start_steps = []
+        if self._capture_audio:
+            self._start_steps.append(self.respeaker.start_capture)
+        # Video recording may also start the preview streams
+        self._start_steps.append(lambda session_dir, prefix: self.video_streamer.start_recording(
+            session_dir, prefix, stream_host=self.ssh_host, stream_base_port=8888))
+        if self.ssh_host:
+            self._start_steps.append(lambda session_dir, prefix: self.video_streamer.start_streaming(
+                self.ssh_host, base_port=8888))
+        
+        self._stop_steps = {
+            'video recording': self.video_streamer.stop_recording,
+            'video streaming': self.video_streamer.stop_streaming
+        }
+        if RESPEAKER_AVAILABLE:
+            self._stop_steps['ReSpeaker capture'] = self.respeaker.stop_capture
+        
+        self.respeaker.on_ssh_state_change = lambda connected: self._refresh_status_cache()
+        self._refresh_status_cache()
+        
+        self._cleaned = False
+        self._cleanup_lock = threading.Lock()
+        self._install_shutdown_hooks()
     
     def set_user_id(self, user_id):
         """Set user ID for file naming"""
@@ -1156,12 +1922,13 @@ class RecordingControl_v3:
             return False
             
         # Sanitize user ID for filename usage
-        clean_user_id = "".join(c for c in user_id.strip() if c.isalnum() or c in ('-', '_'))
+        clean_user_id = _USER_ID_RE.sub('', user_id.strip())
         
         if not clean_user_id:
             return False
             
         self.user_id = clean_user_id
+        self._invalidate_status()
         return True
     
     def _create_session_directory(self, timestamp):
@@ -1176,7 +1943,7 @@ class RecordingControl_v3:
         # Create the directory
         os.makedirs(session_dir_path, exist_ok=True)
         
-        print(f"Created session directory: {session_dir_path}")
+        logger.info("Created session directory: %s", session_dir_path)
         return session_dir_path
     
     def start_recording(self):
@@ -1192,135 +1959,209 @@ class RecordingControl_v3:
         filename_prefix = self.user_id if self.user_id.strip() else "unknown_user"
         
         try:
-            print(f"Starting recording session: {timestamp}")
-            print(f"Session directory: {self.current_session_dir}")
+            logger.info("Starting recording session: %s", timestamp)
+            logger.info("Session directory: %s", self.current_session_dir)
             
-            # Start ReSpeaker capture
-            if RESPEAKER_AVAILABLE and self.respeaker.device_index:
-                self.respeaker.start_capture(self.current_session_dir, filename_prefix)
-            
-            # Start video recording
-            self.video_streamer.start_recording(self.current_session_dir, filename_prefix)
-            
-            # Start video streaming if SSH host is configured
-            if self.ssh_host:
-                self.video_streamer.start_streaming(self.ssh_host, base_port=8888)
+            for start_step in self._start_steps:
+                start_step(self.current_session_dir, filename_prefix)
             
             self.is_recording = True
-            self.start_time = time.time()
+            self.start_time = time.monotonic()  # duration only, immune to clock steps
+            self._refresh_status_cache()
             
-            print(f"Recording session started in: {self.current_session_dir}")
-            if RESPEAKER_AVAILABLE and self.respeaker.device_index:
-                print(f"  ReSpeaker raw: {filename_prefix}_respeaker_raw.wav")
-                print(f"  DOA log: {filename_prefix}_doa_log.json")
-            print(f"  Video: {filename_prefix}_camera1.avi, {filename_prefix}_camera2.avi")
+            logger.info("Recording session started in: %s", self.current_session_dir)
+            if self._capture_audio:
+                logger.info("  ReSpeaker raw: %s_respeaker_raw.wav", filename_prefix)
+                logger.info("  DOA log: %s_doa_log.json", filename_prefix)
+            # Named by the backend that actually started (.avi, .mp4 or .mkv)
+            logger.info("  Video: %s", ', '.join(
+                os.path.basename(path) for path in self.video_streamer.output_files))
             if self.ssh_host:
-                print(f"  Audio streaming to: {self.ssh_host}:9999")
-                print(f"  Video streaming to: {self.ssh_host}:8888-8889")
+                logger.info("  Audio streaming to: %s:9999", self.ssh_host)
+                logger.info("  Video streaming to: %s:8888-8889", self.ssh_host)
             
             return True
             
-        except Exception as e:
-            print(f"Failed to start recording: {e}")
-            self.stop_recording()
+        except Exception:
+            logger.exception("Failed to start recording")
+            # is_recording is still False here, so tear down directly
+            self._stop_subsystems()
             return False
     
+    def _stop_subsystems(self):
+        """Stop video recording/streaming and ReSpeaker capture, returns True if all stopped cleanly
+        
+        The steps run in parallel since each mostly waits for its
+        processes/threads to exit; one failing doesn't skip the others.
+        """
+        stop_steps = self._stop_steps
+        pool = ThreadPoolExecutor(max_workers=len(stop_steps))
+        futures = {pool.submit(step): name for name, step in stop_steps.items()}
+        done, not_done = wait(futures, timeout=STOP_TIMEOUT)
+        pool.shutdown(wait=False)
+        
+        all_ok = not not_done
+        for future in done:
+            error = future.exception()
+            if error is not None:
+                logger.error("Error stopping %s", futures[future], exc_info=error)
+                all_ok = False
+        for future in not_done:
+            logger.warning("Timed out stopping %s", futures[future])
+        
+        self._refresh_status_cache()
+        return all_ok
+    
+    def _log_session_files(self):
+        """List all files created in the session directory"""
+        if not self.current_session_dir:
+            return
+        try:
+            with os.scandir(self.current_session_dir) as it:
+                files = sorted((entry.name, entry.stat().st_size) for entry in it if entry.is_file())
+        except OSError:
+            return
+        
+        logger.info("Files created in %s:", self.current_session_dir)
+        for name, size in files:
+            logger.info("  %s (%.2f MB)", name, size / 1024 / 1024)
+        
+        total_mb = sum(size for _, size in files) / 1024 / 1024
+        try:
+            free_gb = shutil.disk_usage(self.current_session_dir).free / 1024 ** 3
+            logger.info("Session total: %.2f MB (%.1f GB free)", total_mb, free_gb)
+        except OSError:
+            logger.info("Session total: %.2f MB", total_mb)
+    
     def stop_recording(self):
         if not self.is_recording:
             return False
-            
-        try:
-            print("Stopping recording session...")
-            
-            # Stop video recording and streaming
-            self.video_streamer.stop_recording()
-            self.video_streamer.stop_streaming()
-            
-            # Stop ReSpeaker capture
-            if RESPEAKER_AVAILABLE:
-                self.respeaker.stop_capture()
-            
-            self.is_recording = False
-            
-            duration = time.time() - self.start_time
-            print(f"Recording session stopped. Duration: {duration:.2f} seconds")
-            
-            # List all files created in the session directory
-            if self.current_session_dir and os.path.exists(self.current_session_dir):
-                files = os.listdir(self.current_session_dir)
-                print(f"Files created in {self.current_session_dir}:")
-                for file in sorted(files):
-                    file_path = os.path.join(self.current_session_dir, file)
-                    size_mb = os.path.getsize(file_path) / 1024 / 1024
-                    print(f"  {file} ({size_mb:.2f} MB)")
-            
-            return True
-                
-        except Exception as e:
-            print(f"Error stopping recording: {e}")
-            return False
+        
+        logger.info("Stopping recording session...")
+        
+        # Flip the status right away; the teardown below takes a few seconds
+        self.is_recording = False
+        self._invalidate_status()
+        
+        all_ok = self._stop_subsystems()
+        
+        duration = time.monotonic() - self.start_time
+        logger.info("Recording session stopped. Duration: %.2f seconds", duration)
+        
+        self._log_session_files()
+        return all_ok
     
-    def get_recording_status(self):
-        """Get current recording status for web interface"""
-        status = {
-            'is_recording': self.is_recording,
+    def _refresh_status_cache(self):
+        """Snapshot subsystem state for get_recording_status()"""
+        if RESPEAKER_AVAILABLE:
+            self._cached_respeaker_init = self.respeaker.device_index is not None
+            self._cached_ssh_connected = self.respeaker.ssh_connected
+        self._cached_video_streaming = self.video_streamer.is_streaming
+        self._cached_camera_count = len(self.video_streamer.camera_devices)
+        
+        # Everything but is_recording/user_id only changes here
+        self._status_template = {
+            'is_recording': False,
             'respeaker_available': RESPEAKER_AVAILABLE,
-            'respeaker_initialized': self.respeaker.device_index is not None if RESPEAKER_AVAILABLE else False,
-            'ssh_connected': self.respeaker.ssh_connected if RESPEAKER_AVAILABLE else False,
-            'video_streaming': self.video_streamer.is_streaming,
-            'cameras_active': len(self.video_streamer.camera_devices),
+            'respeaker_initialized': self._cached_respeaker_init,
+            'ssh_connected': self._cached_ssh_connected,
+            'video_streaming': self._cached_video_streaming,
+            'cameras_active': self._cached_camera_count,
             'laptop_ip': self.ssh_host,
-            'user_id': self.user_id,
+            'user_id': None,
             'session_directory': self.current_session_dir
         }
+        self._invalidate_status()
+    
+    def _invalidate_status(self):
+        """Force the next get_recording_status() call to rebuild the status"""
+        self._status_cache = (0.0, None)
+    
+    def get_recording_status(self):
+        """Get current recording status for web interface"""
+        cached_at, cached = self._status_cache
+        now = time.monotonic()
+        if cached is not None and now - cached_at < self._status_ttl:
+            status = cached.copy()
+            if self.is_recording:
+                status['duration'] = now - self.start_time
+            return status
+        
+        status = self._status_template.copy()
+        status['is_recording'] = self.is_recording
+        status['user_id'] = self.user_id
         
         if self.is_recording:
-            status['duration'] = time.time() - self.start_time
+            status['duration'] = now - self.start_time
             
             # Get current DOA if available
             if RESPEAKER_AVAILABLE and self.respeaker.Mic_tuning:
-                status['current_doa'] = self.respeaker.get_current_doa()
+                status['current_doa'] = self.respeaker.get_current_doa(max_age=1.0)
         
-        return status
+        self._status_cache = (now, status)
+        return status.copy()
     
     def list_user_sessions(self, user_id=None):
         """List all recording sessions for a user"""
         if user_id is None:
             user_id = self.user_id
         
+        # scandir entries carry the file type from the directory read, so
+        # only the size needs a stat per file
         sessions = []
-        if os.path.exists(self.base_recording_dir):
-            for item in os.listdir(self.base_recording_dir):
-                if item.startswith(f"{user_id}_") and os.path.isdir(os.path.join(self.base_recording_dir, item)):
-                    session_path = os.path.join(self.base_recording_dir, item)
-                    
-                    # Get session info
-                    session_info = {
-                        'directory': item,
-                        'path': session_path,
-                        'timestamp': item.split('_', 1)[1] if '_' in item else 'unknown',
-                        'files': []
-                    }
-                    
-                    # List files in session
-                    if os.path.exists(session_path):
-                        for file in os.listdir(session_path):
-                            file_path = os.path.join(session_path, file)
-                            if os.path.isfile(file_path):
-                                size_mb = os.path.getsize(file_path) / 1024 / 1024
-                                session_info['files'].append({
-                                    'name': file,
-                                    'size_mb': round(size_mb, 2)
-                                })
-                    
-                    sessions.append(session_info)
+        prefix = f"{user_id}_"
+        try:
+            with os.scandir(self.base_recording_dir) as entries:
+                session_entries = [e for e in entries if e.name.startswith(prefix) and e.is_dir()]
+        except FileNotFoundError:
+            session_entries = []
+        
+        for entry in session_entries:
+            # Get session info
+            session_info = {
+                'directory': entry.name,
+                'path': entry.path,
+                'timestamp': entry.name.split('_', 1)[1] if '_' in entry.name else 'unknown',
+                'files': []
+            }
+            
+            # List files in session
+            try:
+                with os.scandir(entry.path) as files:
+                    for file in files:
+                        if file.is_file():
+                            size_mb = file.stat().st_size / 1024 / 1024
+                            session_info['files'].append({
+                                'name': file.name,
+                                'size_mb': round(size_mb, 2)
+                            })
+            except OSError:
+                pass
+            
+            sessions.append(session_info)
         
         # Sort by timestamp (newest first)
         sessions.sort(key=lambda x: x['timestamp'], reverse=True)
         return sessions
     
+    def _install_shutdown_hooks(self):
+        """Run cleanup() at interpreter exit, including on SIGTERM (systemctl stop)"""
+        atexit.register(self.cleanup)
+        
+        # Only from the main thread, and don't replace a handler someone else set
+        if threading.current_thread() is threading.main_thread() and \
+                signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
     def cleanup(self):
-        """Cleanup all resources"""
+        """Cleanup all resources (safe to call more than once)"""
+        # Claim cleanup before doing any work so a SIGTERM/atexit arriving
+        # mid-cleanup returns immediately instead of tearing down twice
+        with self._cleanup_lock:
+            if self._cleaned:
+                return
+            self._cleaned = True
+        
         if self.is_recording:
             self.stop_recording()
         
@@ -1328,6 +2169,7 @@ class RecordingControl_v3:
             self.respeaker.cleanup()
         
         self.video_streamer.cleanup()
+        self._refresh_status_cache()
 
 
 # For backward compatibility with existing Flask interface
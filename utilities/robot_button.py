@@ -1,9 +1,30 @@
 #!/usr/bin/env python3
 
-from time import sleep
+from time import monotonic, sleep
 import threading
 import math
 
+
+def _clamp_speed(speed, threshold):
+    """Raise a non-zero speed below threshold to +/-threshold"""
+    return int(math.copysign(max(threshold, abs(speed)), speed)) if speed else 0
+
+
+# Final stretch of a timed wait spent spinning on the clock instead of sleeping,
+# so the scheduler's wakeup jitter doesn't stretch short rotations
+_SPIN_TAIL = 0.002
+
+
+def _precise_sleep(duration):
+    """Sleep for duration seconds, spinning for the last _SPIN_TAIL"""
+    end = monotonic() + duration
+    coarse = duration - _SPIN_TAIL
+    if coarse > 0.001:  # too short to be worth a sleep() wakeup
+        sleep(coarse)
+    while monotonic() < end:
+        pass
+
+
 class RobotButtonControl:
     # SPEED_SLOW = 0.3
     # SPEED_MODERATE = 0.5
@@ -54,63 +75,229 @@ class RobotButtonControl:
         }
     }
 
+    _VALID_LEVELS = frozenset(HARD_CODED_SPEEDS)
+
+    __slots__ = (
+        'a_star', 'is_moving', 'speed_level', 'force_resend_interval',
+        '_cmd', '_fwd', '_bwd', '_rotL', '_rotR',
+        '_cmd_lock', '_rotation_timer', '_batch', '_batch_owner', '_sequence_cancel',
+        '_last_cmd', '_last_cmd_time'
+    )
+
+    MIN_MOTOR_THRESHOLD = 60
+
+    # Open-loop rotation time: 0.5 s per 90 degrees
+    _ROTATE_DURATION = {45: 0.25, 90: 0.5, 180: 1.0}
+
     def __init__(self, a_star):
         self.a_star = a_star
         self.is_moving = False
         self.speed_level = "fast"
+        self._cmd = {}  # (speed_level, action) -> clamped (left, right)
+        self._prepare()
+        self._bind_level()
+        # Serializes cancelling/replacing timed work with the motor write, so
+        # a rotation timer or batch step that was just superseded can't send
+        # after the newer command. Reentrant: _rotate and _stop go through _write.
+        self._cmd_lock = threading.RLock()
+        self._rotation_timer = None  # stops a timed rotation
+        self._batch = None  # buffered (speeds, duration) steps between begin/end_batch
+        self._batch_owner = None  # thread that opened the batch
+        self._sequence_cancel = None  # set to abort a running batch
+
+        # A held button repeats the same command; identical non-zero speeds
+        # are only resent after force_resend_interval seconds. Stops always go out.
+        self.force_resend_interval = 0.5
+        self._last_cmd = None
+        self._last_cmd_time = 0.0
+
+    def _prepare(self):
+        for level, commands in self.HARD_CODED_SPEEDS.items():
+            for action, (left, right) in commands.items():
+                self._cmd[(level, action)] = self._clamp(left, right)
+
+    def _clamp(self, left, right):
+        """Raise non-zero speeds below MIN_MOTOR_THRESHOLD to the threshold"""
+        threshold = self.MIN_MOTOR_THRESHOLD
+        return _clamp_speed(left, threshold), _clamp_speed(right, threshold)
+
+    def _bind_level(self):
+        """Bind the current speed level's commands so each command skips the lookup"""
+        level = self.speed_level
+        self._fwd = self._cmd[(level, "forward")]
+        self._bwd = self._cmd[(level, "backward")]
+        self._rotL = self._cmd[(level, "rotate_left")]
+        self._rotR = self._cmd[(level, "rotate_right")]
 
     def set_speed(self, speed_level):
-        if speed_level in self.HARD_CODED_SPEEDS:
+        if speed_level in self._VALID_LEVELS:
             self.speed_level = speed_level
+            self._bind_level()
         return self.speed_level
 
-    def motors(self, left, right):
-        MIN_MOTOR_THRESHOLD = 60
-        if left != 0 and abs(left) < MIN_MOTOR_THRESHOLD:
-            left = MIN_MOTOR_THRESHOLD if left > 0 else -MIN_MOTOR_THRESHOLD
-        if right != 0 and abs(right) < MIN_MOTOR_THRESHOLD:
-            right = MIN_MOTOR_THRESHOLD if right > 0 else -MIN_MOTOR_THRESHOLD
+    def motors(self, left, right, duration=0.0):
+        """Set motor speeds; between begin_batch() and end_batch() the call
+        is queued as a step held for duration seconds instead"""
+        out = self._clamp(left, right)
+        if out == (0, 0):
+            # Stops are never deferred
+            self.stop_movement()
+            return
+
+        if not self._queue_step(out, duration):
+            self._write(out)
+
+    def begin_batch(self):
+        """Start queueing this thread's motors(), move_* and rotate_* calls as
+        timed steps for end_batch()
 
-        self.a_star.motors(left, right)
+        Commands from other threads (the HTTP routes) still go out immediately,
+        and a stop from any thread discards the open batch.
+        """
+        self._batch = []
+        self._batch_owner = threading.get_ident()
 
-    def move_forward(self):
-        left, right = self.HARD_CODED_SPEEDS[self.speed_level]["forward"]
-        self.motors(left, right)
-        self.is_moving = True
+    def _queue_step(self, speeds, duration):
+        """Queue speeds as a batch step if this thread has a batch open"""
+        batch = self._batch
+        if batch is None or self._batch_owner != threading.get_ident():
+            return False
+        batch.append((speeds, duration))
+        return True
 
-    def move_backward(self):
-        left, right = self.HARD_CODED_SPEEDS[self.speed_level]["backward"]
-        self.motors(left, right)
-        self.is_moving = True
+    def end_batch(self):
+        """Play the queued steps on a background thread, then stop
+
+        The A-Star firmware has no sequence command, so the steps are timed
+        here; any new command aborts the sequence.
+        """
+        steps, self._batch = self._batch, None
+        self._batch_owner = None
+        if not steps:
+            return
+        cancel = threading.Event()
+        with self._cmd_lock:
+            self._cancel_pending()
+            self._sequence_cancel = cancel
+        threading.Thread(target=self._run_sequence, args=(steps, cancel), daemon=True).start()
+
+    def _run_sequence(self, steps, cancel):
+        lock = self._cmd_lock
+        for speeds, duration in steps:
+            with lock:
+                if cancel.is_set():
+                    return
+                self._send(speeds)
+                self.is_moving = speeds != (0, 0)
+            end = monotonic() + duration
+            if cancel.wait(max(0.0, duration - _SPIN_TAIL)):
+                return
+            _precise_sleep(end - monotonic())
+        with lock:
+            if not cancel.is_set():
+                self._send((0, 0))
+                self.is_moving = False
+
+    def _cancel_pending(self):
+        """Abort a pending timed-rotation stop or a running batch"""
+        timer = self._rotation_timer
+        if timer is not None:
+            timer.cancel()
+            self._rotation_timer = None
+        cancel = self._sequence_cancel
+        if cancel is not None:
+            cancel.set()
+            self._sequence_cancel = None
+
+    def _write(self, speeds):
+        """Send already-clamped (left, right) speeds as a new command"""
+        # Any new command supersedes pending timed work
+        with self._cmd_lock:
+            self._cancel_pending()
+            self._send(speeds)
+
+    def _send(self, speeds):
+        now = monotonic()
+        if (speeds == self._last_cmd and speeds != (0, 0)
+                and now - self._last_cmd_time < self.force_resend_interval):
+            return
+
+        self.a_star.motors(*speeds)
+        self._last_cmd = speeds
+        self._last_cmd_time = now
+
+    def _drive(self, speeds, duration=0.0):
+        if self._queue_step(speeds, duration):
+            return
+        with self._cmd_lock:
+            self._write(speeds)
+            self.is_moving = True
+
+    # duration only applies inside a batch: how long the step is held
+    def move_forward(self, duration=0.0):
+        self._drive(self._fwd, duration)
+
+    def move_backward(self, duration=0.0):
+        self._drive(self._bwd, duration)
 
     def stop_movement(self):
-        self.motors(0, 0)
-        self.is_moving = False
+        # Sent immediately even with a batch open; the batch is dropped
+        self._batch = None
+        self._batch_owner = None
+        self._stop()
 
-    def rotate_left_continuous(self):
-        left, right = self.HARD_CODED_SPEEDS[self.speed_level]["rotate_left"]
-        self.motors(left, right)
-        self.is_moving = True
+    def _stop(self):
+        with self._cmd_lock:
+            self._write((0, 0))
+            self.is_moving = False
 
-    def rotate_right_continuous(self):
-        left, right = self.HARD_CODED_SPEEDS[self.speed_level]["rotate_right"]
-        self.motors(left, right)
-        self.is_moving = True
+    def rotate_left_continuous(self, duration=0.0):
+        self._drive(self._rotL, duration)
 
-    def _rotate(self, angle):
-        self.stop_movement()
+    def rotate_right_continuous(self, duration=0.0):
+        self._drive(self._rotR, duration)
 
+    def _rotate(self, angle):
         if angle > 0:
-            left, right = self.HARD_CODED_SPEEDS[self.speed_level]["rotate_right"]
+            speeds = self._rotR
         else:
-            left, right = self.HARD_CODED_SPEEDS[self.speed_level]["rotate_left"]
+            speeds = self._rotL
+
+        duration = self._ROTATE_DURATION.get(abs(angle))
+        if duration is None:
+            duration = abs(angle) / 90.0 * 0.5
+
+        # Inside a batch the rotation is just a timed step
+        if self._queue_step(speeds, duration):
+            return
+
+        with self._cmd_lock:
+            # Skip the stop write if the last command already stopped the motors
+            # (is_moving doesn't see gamepad /motors commands)
+            if self._last_cmd != (0, 0):
+                self._stop()
+
+            # Stop from a timer so the request handler returns immediately; the
+            # timer fires _SPIN_TAIL early and spins out the rest
+            self._drive(speeds)
+            deadline = monotonic() + duration
+            timer = threading.Timer(max(0.0, duration - _SPIN_TAIL),
+                                    lambda: self._finish_rotation(timer, deadline))
+            timer.daemon = True
+            self._rotation_timer = timer
+            timer.start()
 
-        base_duration = abs(angle) / 90.0 * 0.5
-        duration = base_duration
+    def _finish_rotation(self, timer, deadline):
+        _precise_sleep(deadline - monotonic())
+        with self._cmd_lock:
+            if self._rotation_timer is timer:  # not superseded while spinning
+                self._stop()
 
-        self.motors(left, right)
-        sleep(duration)
-        self.stop_movement()
+    def wait_for_rotation(self, timeout=None):
+        """Block until a pending timed rotation has stopped (or was superseded)"""
+        timer = self._rotation_timer
+        if timer is not None:
+            timer.join(timeout)
 
     def rotate_left_45(self):
         self._rotate(-45)